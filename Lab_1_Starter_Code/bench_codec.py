@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+"""Micro-benchmark of the binary codec against the old pickle encoding
+
+Usage: python bench_codec.py [number of switches]
+
+For every message type it prints the encoded size and the encode/decode time
+per message for pickle and for codec.py.
+"""
+
+import pickle
+import sys
+import timeit
+
+from codec import decode, encode
+
+
+def sample_messages(num_switches):
+    '''Returns one message of each type, sized for a topology of num_switches'''
+    neighbors = list(range(1, num_switches))
+    rows = [[0, dest_id, dest_id % 7, ] for dest_id in range(num_switches)]
+    return [
+        ['Register_Request', 0, None],
+        ['Keep_Alive', 0],
+        ['Register_Response', [(switch_id, 'localhost', 5000 + switch_id) for switch_id in range(num_switches)],
+         {switch_id: None for switch_id in range(num_switches)}],
+        ['Topology_Update', 0, 1, {neighbor: True for neighbor in neighbors}],
+        ['Topology_Update_Delta', 0, 2, 1, {neighbors[0]: False}],
+        ['Topology_Ack', 2],
+        ['Routing_Update', rows, 1],
+        ['Routing_Update_Delta', 0, 2, 1, rows[:num_switches // 10 + 1], []],
+        ['Routing_Resync', 0],
+    ]
+
+
+def time_per_call(function, argument):
+    '''Returns the time in microseconds of one call of function(argument)'''
+    timer = timeit.Timer(lambda: function(argument))
+    number, total = timer.autorange()
+    return total / number * 1e6
+
+
+def main():
+    num_switches = 64
+    if len(sys.argv) > 1:
+        num_switches = int(sys.argv[1])
+
+    print(f'Messages sized for {num_switches} switches')
+    print(f'{"message":<22}{"pickle B":>10}{"codec B":>10}{"pickle enc us":>15}{"codec enc us":>14}{"pickle dec us":>15}{"codec dec us":>14}')
+    for message in sample_messages(num_switches):
+        pickled = pickle.dumps(message)
+        encoded = encode(message)
+        assert decode(encoded) == message
+        print(f'{message[0]:<22}{len(pickled):>10}{len(encoded):>10}'
+              f'{time_per_call(pickle.dumps, message):>15.2f}{time_per_call(encode, message):>14.2f}'
+              f'{time_per_call(pickle.loads, pickled):>15.2f}{time_per_call(decode, encoded):>14.2f}')
+
+
+if __name__ == "__main__":
+    main()
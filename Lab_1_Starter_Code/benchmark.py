@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+
+"""Benchmarks of the controller route computation and message handling for ECE50863 Lab Project 1
+
+Usage: python benchmark.py [-t ring,grid,fattree,random] [-n 64,256] [-l link failures] [-d dead switches]
+                           [-b python|numpy|process] [-r repeats] [-s seed] [-o results.json] [-c baseline.json]
+
+For every topology type and size a synthetic graph_n.txt file is written
+and the controller code is timed on it: open_file(), create_graph(),
+dijkstra() for one source, a full create_routing_table() and the encode and
+decode of the Routing_Update of one switch and of the Register_Response.
+-l fails that many random links (at most one per switch, like switch.py -f)
+and -d marks that many random switches as dead.
+
+Every operation is timed with timeit (best of -r repeats) and reported as
+operations per second. The peak memory of one extra run is measured with
+tracemalloc. -o saves the results as JSON and -c compares them with a file
+saved earlier, e.g. on another commit.
+"""
+
+import contextlib
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+from codec import decode, encode
+from controller import Controller, open_file
+from route_cache import RouteCache
+from routing import dijkstra
+
+TOPOLOGIES = ['ring', 'grid', 'fattree', 'random']
+REGRESSION = 0.10 # slower by more than this is reported as a regression
+
+
+def ring_links(num_switches, rng):
+    '''Every switch is linked to the next one'''
+    return [(i, (i + 1) % num_switches, rng.randint(1, 100)) for i in range(num_switches)]
+
+
+def grid_links(num_switches, rng):
+    '''Switches on a square grid, linked to their right and lower neighbors'''
+    side = 1
+    while side * side < num_switches:
+        side += 1
+    links = []
+    for i in range(num_switches):
+        row, column = divmod(i, side)
+        if column + 1 < side and i + 1 < num_switches:
+            links.append((i, i + 1, rng.randint(1, 100)))
+        if i + side < num_switches:
+            links.append((i, i + side, rng.randint(1, 100)))
+    return links
+
+
+def fat_tree_links(num_switches, rng):
+    '''A k-ary fat-tree with (k/2)^2 core switches and k pods of k/2
+    aggregation and k/2 edge switches, for the largest even k whose 5k^2/4
+    switches fit in num_switches. The remaining switches are hosts, one per
+    edge switch in turn.'''
+    k = 2
+    while 5 * (k + 2) * (k + 2) // 4 <= num_switches:
+        k += 2
+    half = k // 2
+    num_core = half * half
+    links = []
+    edge_switches = []
+    for pod in range(k):
+        aggregation = [num_core + pod * k + i for i in range(half)]
+        edge = [num_core + pod * k + half + i for i in range(half)]
+        edge_switches.extend(edge)
+        for i, aggregation_id in enumerate(aggregation):
+            for j in range(half):
+                links.append((aggregation_id, i * half + j, rng.randint(1, 100)))
+            for edge_id in edge:
+                links.append((aggregation_id, edge_id, rng.randint(1, 100)))
+    for host_id in range(num_core + k * k, num_switches):
+        edge_id = edge_switches[(host_id - num_core - k * k) % len(edge_switches)]
+        links.append((edge_id, host_id, rng.randint(1, 100)))
+    return links
+
+
+def random_links(num_switches, rng):
+    '''A random spanning tree plus random links, about 4 links per switch'''
+    links = {}
+    for i in range(1, num_switches):
+        links[(rng.randrange(i), i)] = rng.randint(1, 100)
+    target = min(2 * num_switches, num_switches * (num_switches - 1) // 2)
+    while len(links) < target:
+        a, b = rng.sample(range(num_switches), 2)
+        links.setdefault((min(a, b), max(a, b)), rng.randint(1, 100))
+    return [(a, b, cost) for (a, b), cost in links.items()]
+
+
+TOPOLOGY_LINKS = {'ring': ring_links, 'grid': grid_links, 'fattree': fat_tree_links, 'random': random_links}
+
+
+def write_config(config_file, num_switches, links):
+    '''Writes a topology in the graph_n.txt format'''
+    with open(config_file, 'w') as f:
+        f.write(f'{num_switches}\n')
+        for self_id, neighbor_id, cost in links:
+            f.write(f'{self_id} {neighbor_id} {cost}\n')
+
+
+def choose_failures(num_switches, links, num_link_failures, num_dead, rng):
+    '''Returns (link_failure, dead) where link_failure has at most one failed
+    neighbor per switch, like the switches' -f flag'''
+    link_failure = {switch_id: None for switch_id in range(num_switches)}
+    candidates = links[:]
+    rng.shuffle(candidates)
+    failed = 0
+    for self_id, neighbor_id, cost in candidates:
+        if failed >= num_link_failures:
+            break
+        if link_failure[self_id] is None and link_failure[neighbor_id] is None:
+            link_failure[self_id] = neighbor_id
+            failed += 1
+    dead = set(rng.sample(range(num_switches), min(num_dead, num_switches)))
+    return link_failure, dead
+
+
+def time_operation(operation, repeats):
+    '''Returns the seconds per call of operation(), best of repeats'''
+    timer = timeit.Timer(operation)
+    number, total = timer.autorange()
+    best = total / number
+    for _ in range(repeats - 1):
+        best = min(best, timer.timeit(number) / number)
+    return best
+
+
+def peak_memory(operation):
+    '''Returns the peak memory in KiB allocated by one call of operation()'''
+    tracemalloc.start()
+    try:
+        operation()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+
+def benchmark_topology(topology, num_switches, num_link_failures, num_dead, routing_backend, repeats, seed, directory):
+    '''Times every operation on one synthetic topology and returns a list of
+    result dictionaries'''
+    rng = random.Random(seed)
+    links = TOPOLOGY_LINKS[topology](num_switches, rng)
+    config_file = os.path.join(directory, f'{topology}_{num_switches}.txt')
+    write_config(config_file, num_switches, links)
+    link_failure, dead = choose_failures(num_switches, links, num_link_failures, num_dead, rng)
+
+    controller = Controller(0, config_file, routing_backend)
+    controller.controller_socket.close()
+    controller.route_cache = RouteCache(0) # time the computation, not the cache
+    controller.link_failure = link_failure
+    controller.live_switches = set(range(num_switches)) - dead
+    controller.d = open_file(config_file, link_failure)
+    controller.create_graph()
+
+    def full_routing_table():
+        controller.dirty_sources = None
+        controller.create_routing_table()
+
+    full_routing_table()
+    source = sorted(controller.live_switches)[0]
+    sources = itertools.cycle(sorted(controller.live_switches))
+    routing_update = controller.generate_full_routing_msg(source, dict(enumerate(controller.next_hops[source])))
+    controller.switch_addresses = {switch_id: ('localhost', 5000 + switch_id) for switch_id in range(num_switches)}
+    register_response = controller.generate_register_response(source)
+    encoded_routing_update = encode(routing_update)
+    encoded_register_response = encode(register_response)
+
+    operations = [
+        ('open_file', lambda: open_file(config_file, link_failure)),
+        ('create_graph', controller.create_graph),
+        ('dijkstra', lambda: dijkstra(controller.graph, controller.live_switches, next(sources))),
+        ('create_routing_table', full_routing_table),
+        ('encode Routing_Update', lambda: encode(routing_update)),
+        ('decode Routing_Update', lambda: decode(encoded_routing_update)),
+        ('encode Register_Response', lambda: encode(register_response)),
+        ('decode Register_Response', lambda: decode(encoded_register_response)),
+    ]
+
+    results = []
+    for name, operation in operations:
+        seconds = time_operation(operation, repeats)
+        results.append({
+            'topology': topology,
+            'switches': num_switches,
+            'links': len(links),
+            'link_failures': num_link_failures,
+            'dead': len(dead),
+            'operation': name,
+            'ops_per_sec': 1 / seconds,
+            'seconds_per_op': seconds,
+            'peak_kib': peak_memory(operation),
+        })
+    if controller.parallel_routing is not None:
+        controller.parallel_routing.shutdown()
+    return results
+
+
+def git_commit():
+    '''Returns the commit being benchmarked, or None outside a git tree'''
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_results(results):
+    print(f'{"topology":<10}{"switches":>9}{"links":>8}  {"operation":<26}{"ops/sec":>12}{"ms/op":>11}{"peak KiB":>11}')
+    for result in results:
+        print(f'{result["topology"]:<10}{result["switches"]:>9}{result["links"]:>8}  {result["operation"]:<26}'
+              f'{result["ops_per_sec"]:>12.1f}{result["seconds_per_op"] * 1000:>11.3f}{result["peak_kib"]:>11.1f}')
+
+
+def result_key(result):
+    '''Results are compared when they ran the same operation on the same
+    topology with the same failures'''
+    return (result['topology'], result['switches'], result['link_failures'], result['dead'], result['operation'])
+
+
+def compare_results(results, baseline):
+    '''Prints the speedup of every result over the matching baseline result
+    and returns the number of regressions'''
+    baseline_results = {}
+    for result in baseline['results']:
+        baseline_results[result_key(result)] = result
+
+    print(f'\nCompared with {baseline.get("commit") or "baseline"} ({baseline.get("date")})')
+    print(f'{"topology":<10}{"switches":>9}  {"operation":<26}{"before ops/sec":>15}{"after ops/sec":>15}{"speedup":>9}')
+    regressions = 0
+    for result in results:
+        before = baseline_results.get(result_key(result))
+        if before is None:
+            continue
+        speedup = result['ops_per_sec'] / before['ops_per_sec']
+        note = ''
+        if speedup < 1 - REGRESSION:
+            note = '  <-- regression'
+            regressions += 1
+        print(f'{result["topology"]:<10}{result["switches"]:>9}  {result["operation"]:<26}'
+              f'{before["ops_per_sec"]:>15.1f}{result["ops_per_sec"]:>15.1f}{speedup:>8.2f}x{note}')
+    return regressions
+
+
+def main():
+    topologies = TOPOLOGIES
+    if "-t" in sys.argv:
+        topologies = sys.argv[sys.argv.index("-t") + 1].split(',')
+    sizes = [64, 256]
+    if "-n" in sys.argv:
+        sizes = [int(size) for size in sys.argv[sys.argv.index("-n") + 1].split(',')]
+    num_link_failures = 0
+    if "-l" in sys.argv:
+        num_link_failures = int(sys.argv[sys.argv.index("-l") + 1])
+    num_dead = 0
+    if "-d" in sys.argv:
+        num_dead = int(sys.argv[sys.argv.index("-d") + 1])
+    routing_backend = 'python'
+    if "-b" in sys.argv:
+        routing_backend = sys.argv[sys.argv.index("-b") + 1]
+    repeats = 3
+    if "-r" in sys.argv:
+        repeats = int(sys.argv[sys.argv.index("-r") + 1])
+    seed = 50863
+    if "-s" in sys.argv:
+        seed = int(sys.argv[sys.argv.index("-s") + 1])
+
+    for topology in topologies:
+        if topology not in TOPOLOGY_LINKS:
+            print(f'Unknown topology {topology}, choose from {",".join(TOPOLOGIES)}')
+            sys.exit(1)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for topology in topologies:
+            for num_switches in sizes:
+                # The controller code prints a lot, keep it out of the report
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    results.extend(benchmark_topology(topology, num_switches, num_link_failures, num_dead,
+                                                      routing_backend, repeats, seed, directory))
+    print_results(results)
+
+    report = {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'routing_backend': routing_backend,
+        'seed': seed,
+        'results': results,
+    }
+    if "-o" in sys.argv:
+        output_file = sys.argv[sys.argv.index("-o") + 1]
+        with open(output_file, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f'\nSaved results to {output_file}')
+
+    if "-c" in sys.argv:
+        with open(sys.argv[sys.argv.index("-c") + 1], 'r') as f:
+            baseline = json.load(f)
+        if compare_results(results, baseline):
+            sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+
+"""Binary wire format for the control messages of ECE50863 Lab Project 1
+
+encode() turns a message list such as ['Keep_Alive', 3] into bytes and
+decode() turns them back into the same list, so the Controller and the
+Switch handle messages exactly as before but never unpickle data coming
+from the network.
+
+Every message starts with a 2 byte header: the protocol version and the
+message type. All numbers are little-endian and -1 stands for a None switch
+id. Lists of numbers are sent as arrays: a typecode byte, a 32 bit count and
+the values, each in the narrowest of 8, 16 or 32 bits that holds all of
+them, so switch ids, next hops and ports mostly take 1 or 2 bytes. The
+message bodies are:
+
+Register_Request      switch_id (int32), failed_id (int32)
+Register_Response     host count, host count x (length, utf-8 host name),
+                      [switch_id], [host index], [port],
+                      [link_failure switch_id], [link_failure failed_id]
+                      The host indexes are empty when there is one host and
+                      the failed ids are empty when they are all None.
+Keep_Alive            switch_id (int32)
+Topology_Update       switch_id (int32), sequence (uint32), [neighbor id],
+                      state bitmap (one bit per neighbor, 1 = alive)
+Routing_Update        version (uint32), routing rows
+Routing_Update_Delta  switch_id (int32), version (uint32), base_version
+                      (uint32), routing rows, [removed dest_id]
+Routing_Resync        switch_id (int32)
+Topology_Update_Delta switch_id (int32), sequence (uint32), base_sequence
+                      (uint32), [neighbor id], state bitmap
+Topology_Ack          sequence (uint32)
+
+Routing rows [<Switch ID>, <Dest ID>, <Next Hop>] are sent as a flags byte,
+a switch_id (int32), then [switch_id] unless every row is for that switch,
+[dest_id] unless the destinations are 0 to n-1 in order (a full table), and
+[next_hop]. A full table for one switch is thus one next hop array.
+"""
+
+import struct
+import sys
+from array import array
+from itertools import chain, repeat
+
+PROTOCOL_VERSION = 3
+
+MESSAGE_TYPES = ['Register_Request', 'Register_Response', 'Keep_Alive', 'Topology_Update',
+                 'Routing_Update', 'Routing_Update_Delta', 'Routing_Resync', 'Topology_Update_Delta',
+                 'Topology_Ack']
+MESSAGE_TYPE_CODES = {message_type: code for code, message_type in enumerate(MESSAGE_TYPES)}
+
+HEADER = struct.Struct('<BB')
+INT = struct.Struct('<i')
+UINT = struct.Struct('<I')
+ID_PAIR = struct.Struct('<ii')
+ID_SEQUENCE = struct.Struct('<iI')
+DELTA_HEADER = struct.Struct('<iII')
+ARRAY_HEADER = struct.Struct('<cI')
+ROWS_HEADER = struct.Struct('<Bi')
+KEEP_ALIVE_MSG = struct.Struct('<BBi')
+KEEP_ALIVE = MESSAGE_TYPE_CODES['Keep_Alive']
+BINARY_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+# The 8 states held by each value of a bitmap byte, lowest bit first
+BYTE_STATES = [tuple(bool(value >> bit & 1) for bit in range(8)) for value in range(256)]
+
+INT_TYPECODES = ('b', 'B', 'h', 'H', 'i')
+
+# Flags of the routing rows
+ROWS_ONE_SWITCH = 0x01 # every row is for the switch_id of the header
+ROWS_ALL_DESTS = 0x02 # the destinations are 0 to n-1 in order
+
+BIG_ENDIAN = sys.byteorder == 'big'
+
+
+def id_or_none(value):
+    if value is None:
+        return -1
+    return value
+
+
+def none_or_id(value):
+    if value == -1:
+        return None
+    return value
+
+
+def pack_array(typecode, values):
+    '''Packs numbers as a little-endian array prefixed by its typecode and 
+    count'''
+    a = array(typecode, values)
+    if BIG_ENDIAN:
+        a.byteswap()
+    return ARRAY_HEADER.pack(typecode.encode(), len(a)) + a.tobytes()
+
+
+def int_typecode(values):
+    '''Returns the array typecode of the narrowest ints that hold all values'''
+    if not values:
+        return 'B'
+    low = min(values)
+    high = max(values)
+    if low >= 0:
+        if high <= 0xFF:
+            return 'B'
+        if high <= 0xFFFF:
+            return 'H'
+    else:
+        if low >= -0x80 and high <= 0x7F:
+            return 'b'
+        if low >= -0x8000 and high <= 0x7FFF:
+            return 'h'
+    return 'i'
+
+
+def pack_ints(values):
+    '''Packs ints as 8, 16 or 32 bit values, whichever is the narrowest 
+    that holds all of them'''
+    if not isinstance(values, (list, tuple)):
+        values = list(values)
+    # Most arrays hold ids that are not negative. Trying the unsigned types 
+    # first usually stops at the first value that does not fit, which is 
+    # cheaper than min() and max() over all of them.
+    try:
+        return ARRAY_HEADER.pack(b'B', len(values)) + bytes(values)
+    except ValueError:
+        pass
+    try:
+        return pack_array('H', values)
+    except OverflowError:
+        pass
+    return pack_array(int_typecode(values), values)
+
+
+def unpack_array(data, offset):
+    '''Returns (list of numbers, new offset) for an array written by 
+    pack_array() or pack_ints()'''
+    typecode, count = ARRAY_HEADER.unpack_from(data, offset)
+    offset += ARRAY_HEADER.size
+    typecode = typecode.decode()
+    if typecode not in INT_TYPECODES:
+        raise ValueError(f'Unknown array type {typecode}')
+    a = array(typecode)
+    end = offset + count * a.itemsize
+    if end > len(data):
+        raise ValueError('Truncated message')
+    a.frombytes(data[offset:end])
+    if BIG_ENDIAN:
+        a.byteswap()
+    return a.tolist(), end
+
+
+def pack_rows(rows):
+    '''Packs routing rows [<Switch ID>, <Dest ID>, <Next Hop>], leaving out
+    the switch ids when they are all the same and the destinations when 
+    they are 0 to n-1'''
+    if not rows:
+        return ROWS_HEADER.pack(ROWS_ONE_SWITCH | ROWS_ALL_DESTS, -1) + pack_ints(())
+    switch_ids, dest_ids, next_hops = zip(*rows)
+    flags = 0
+    parts = []
+    if switch_ids.count(switch_ids[0]) == len(switch_ids):
+        flags |= ROWS_ONE_SWITCH
+    else:
+        parts.append(pack_ints(switch_ids))
+    if dest_ids == tuple(range(len(dest_ids))):
+        flags |= ROWS_ALL_DESTS
+    else:
+        parts.append(pack_ints(dest_ids))
+    parts.append(pack_ints(next_hops))
+    return ROWS_HEADER.pack(flags, switch_ids[0]) + b''.join(parts)
+
+
+def unpack_rows(data, offset):
+    '''Returns (rows, new offset) for rows written by pack_rows()'''
+    flags, switch_id = ROWS_HEADER.unpack_from(data, offset)
+    offset += ROWS_HEADER.size
+    if not flags & ROWS_ONE_SWITCH:
+        switch_ids, offset = unpack_array(data, offset)
+    if not flags & ROWS_ALL_DESTS:
+        dest_ids, offset = unpack_array(data, offset)
+    next_hops, offset = unpack_array(data, offset)
+    if flags & ROWS_ONE_SWITCH:
+        switch_ids = repeat(switch_id, len(next_hops))
+    elif len(switch_ids) != len(next_hops):
+        raise ValueError('Routing row arrays differ in length')
+    if flags & ROWS_ALL_DESTS:
+        dest_ids = range(len(next_hops))
+    elif len(dest_ids) != len(next_hops):
+        raise ValueError('Routing row arrays differ in length')
+    return list(map(list, zip(switch_ids, dest_ids, next_hops))), offset
+
+
+def pack_states(neighbor_state):
+    '''Packs {neighbor_id: alive} as the neighbor ids followed by a bitmap 
+    of their states. Bit i of the little-endian bitmap is the state of the 
+    i-th neighbor, so the bitmap is built as one integer from a string of 
+    binary digits instead of bit by bit. The states must be bools.'''
+    states = bytes(list(neighbor_state.values()))
+    value = int(states[::-1].translate(BINARY_DIGITS), 2) if states else 0
+    return pack_ints(neighbor_state.keys()) + value.to_bytes((len(states) + 7) // 8, 'little')
+
+
+def unpack_states(data, offset):
+    '''Returns ({neighbor_id: alive}, new offset) for states written by 
+    pack_states()'''
+    ids, offset = unpack_array(data, offset)
+    end = offset + (len(ids) + 7) // 8
+    if end > len(data):
+        raise ValueError('Truncated message')
+    states = chain.from_iterable(map(BYTE_STATES.__getitem__, data[offset:end]))
+    return dict(zip(ids, states)), end
+
+
+def encode(message):
+    '''Encodes a message list into bytes to be sent'''
+    message_type = message[0]
+    code = MESSAGE_TYPE_CODES[message_type]
+
+    if message_type == 'Keep_Alive':
+        return KEEP_ALIVE_MSG.pack(PROTOCOL_VERSION, code, message[1])
+
+    parts = [HEADER.pack(PROTOCOL_VERSION, code)]
+
+    if message_type == 'Register_Request':
+        parts.append(ID_PAIR.pack(message[1], id_or_none(message[2])))
+
+    elif message_type == 'Register_Response':
+        # ['Register_Response', [(switch_id, addr, port), ...], link_failure]
+        # Host names are sent once and referenced by index
+        switch_ids, addrs, ports = [], [], []
+        if message[1]:
+            switch_ids, addrs, ports = zip(*message[1])
+        # Usually every switch runs on the same host, then no host indexes 
+        # are sent
+        host_indexes = []
+        if addrs and addrs.count(addrs[0]) == len(addrs):
+            hosts = {addrs[0]: 0}
+        else:
+            hosts = {addr: index for index, addr in enumerate(dict.fromkeys(addrs))}
+            host_indexes = list(map(hosts.__getitem__, addrs))
+        parts.append(UINT.pack(len(hosts)))
+        for addr in hosts:
+            host = addr.encode('utf-8')
+            parts.append(UINT.pack(len(host)))
+            parts.append(host)
+        parts.append(pack_ints(switch_ids))
+        parts.append(pack_ints(host_indexes))
+        parts.append(pack_ints(ports))
+        link_failure = message[2]
+        parts.append(pack_ints(link_failure.keys()))
+        failed_ids = list(link_failure.values())
+        if failed_ids.count(None) == len(failed_ids):
+            failed_ids = []
+        else:
+            failed_ids = [-1 if failed_id is None else failed_id for failed_id in failed_ids]
+        parts.append(pack_ints(failed_ids))
+
+    elif message_type == 'Topology_Update':
+        # ['Topology_Update', switch_id, sequence, neighbor_state]
+        parts.append(ID_SEQUENCE.pack(message[1], message[2]))
+        parts.append(pack_states(message[3]))
+
+    elif message_type == 'Topology_Update_Delta':
+        # ['Topology_Update_Delta', switch_id, sequence, base_sequence, changes]
+        parts.append(DELTA_HEADER.pack(message[1], message[2], message[3]))
+        parts.append(pack_states(message[4]))
+
+    elif message_type == 'Topology_Ack':
+        # ['Topology_Ack', sequence]
+        parts.append(UINT.pack(message[1]))
+
+    elif message_type == 'Routing_Update':
+        # ['Routing_Update', rows, version]
+        version = 0
+        if len(message) > 2:
+            version = message[2]
+        parts.append(UINT.pack(version))
+        parts.append(pack_rows(message[1]))
+
+    elif message_type == 'Routing_Update_Delta':
+        # ['Routing_Update_Delta', switch_id, version, base_version, rows, removed]
+        parts.append(DELTA_HEADER.pack(message[1], message[2], message[3]))
+        parts.append(pack_rows(message[4]))
+        parts.append(pack_ints(message[5]))
+
+    elif message_type == 'Routing_Resync':
+        parts.append(INT.pack(message[1]))
+
+    return b''.join(parts)
+
+
+def decode(data):
+    '''Decodes bytes created by encode() back into the message list. Raises
+    ValueError if the data is not a valid message.'''
+    if len(data) == KEEP_ALIVE_MSG.size:
+        # The most common message, decoded without going through the others
+        version, code, switch_id = KEEP_ALIVE_MSG.unpack(data)
+        if version == PROTOCOL_VERSION and code == KEEP_ALIVE:
+            return ['Keep_Alive', switch_id]
+    try:
+        return decode_message(data)
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f'Malformed message: {e}')
+
+
+def decode_message(data):
+    version, code = HEADER.unpack_from(data, 0)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f'Unsupported protocol version {version}')
+    if code >= len(MESSAGE_TYPES):
+        raise ValueError(f'Unknown message type {code}')
+    message_type = MESSAGE_TYPES[code]
+    offset = HEADER.size
+
+    if message_type == 'Keep_Alive':
+        switch_id, = INT.unpack_from(data, offset)
+        return [message_type, switch_id]
+
+    elif message_type == 'Register_Request':
+        switch_id, failed_id = ID_PAIR.unpack_from(data, offset)
+        return [message_type, switch_id, none_or_id(failed_id)]
+
+    elif message_type == 'Register_Response':
+        count, = UINT.unpack_from(data, offset)
+        offset += UINT.size
+        hosts = []
+        for i in range(count):
+            host_length, = UINT.unpack_from(data, offset)
+            offset += UINT.size
+            hosts.append(data[offset:offset + host_length].decode('utf-8'))
+            offset += host_length
+        switch_ids, offset = unpack_array(data, offset)
+        host_indexes, offset = unpack_array(data, offset)
+        ports, offset = unpack_array(data, offset)
+        if not host_indexes and switch_ids:
+            addrs = repeat(hosts[0], len(switch_ids))
+        elif len(host_indexes) == len(switch_ids):
+            addrs = map(hosts.__getitem__, host_indexes)
+        else:
+            raise ValueError('Register_Response arrays differ in length')
+        if len(switch_ids) != len(ports):
+            raise ValueError('Register_Response arrays differ in length')
+        switches = list(zip(switch_ids, addrs, ports))
+        switch_ids, offset = unpack_array(data, offset)
+        failed_ids, offset = unpack_array(data, offset)
+        if not failed_ids:
+            link_failure = dict.fromkeys(switch_ids)
+        elif len(failed_ids) == len(switch_ids):
+            link_failure = dict(zip(switch_ids, [None if failed_id == -1 else failed_id for failed_id in failed_ids]))
+        else:
+            raise ValueError('Register_Response arrays differ in length')
+        return [message_type, switches, link_failure]
+
+    elif message_type == 'Topology_Update':
+        switch_id, sequence = ID_SEQUENCE.unpack_from(data, offset)
+        offset += ID_SEQUENCE.size
+        neighbor_state, offset = unpack_states(data, offset)
+        return [message_type, switch_id, sequence, neighbor_state]
+
+    elif message_type == 'Topology_Update_Delta':
+        switch_id, sequence, base_sequence = DELTA_HEADER.unpack_from(data, offset)
+        offset += DELTA_HEADER.size
+        changes, offset = unpack_states(data, offset)
+        return [message_type, switch_id, sequence, base_sequence, changes]
+
+    elif message_type == 'Topology_Ack':
+        sequence, = UINT.unpack_from(data, offset)
+        return [message_type, sequence]
+
+    elif message_type == 'Routing_Update':
+        version, = UINT.unpack_from(data, offset)
+        offset += UINT.size
+        rows, offset = unpack_rows(data, offset)
+        return [message_type, rows, version]
+
+    elif message_type == 'Routing_Update_Delta':
+        switch_id, version, base_version = DELTA_HEADER.unpack_from(data, offset)
+        offset += DELTA_HEADER.size
+        rows, offset = unpack_rows(data, offset)
+        removed, offset = unpack_array(data, offset)
+        return [message_type, switch_id, version, base_version, rows, removed]
+
+    elif message_type == 'Routing_Resync':
+        switch_id, = INT.unpack_from(data, offset)
+        return [message_type, switch_id]
@@ -9,15 +9,26 @@ Last Modified Date: December 9th, 2021
 import sys
 from datetime import date, datetime
 import socket
-import heapq
-import pickle
 import signal
 import time
 import threading
+import queue
+
+import metrics
+import transport
+from codec import decode, encode
+from liveness import LivenessTracker
+from log_writer import flush_logs, get_log_writer
+from parallel_routing import ParallelRouting
+from route_cache import RouteCache, graph_digest, topology_key
+from snapshot import load_snapshot, save_snapshot, topology_digest
+from topology_file import read_links
+from routing import INFINITY, all_pairs_shortest_paths, all_pairs_shortest_paths_numpy, dijkstra, routing_table_rows, sources_affected_by_link, sources_affected_by_switch
 
 def handler(signum, frame):
     # res = input("Ctrl-c was pressed. Do you really want to exit? y/n ")
     print("Ctrl-c was pressed. Quiting...")
+    flush_logs()
     # if res == 'y':
     exit(1)
 signal.signal(signal.SIGINT, handler)
@@ -73,13 +84,18 @@ def register_response_sent(switch_id):
 # After switch 1 is killed, the routing update from the controller does not have routes from switch 1 to other switches.
 
 def routing_table_update(routing_table):
+    # Formatting the rows is left to the log writer thread
+    timestamp = str(datetime.time(datetime.now()))
+    get_log_writer(LOG_FILE).write_lazy(format_routing_table_update, timestamp, routing_table)
+
+def format_routing_table_update(timestamp, routing_table):
     log = []
-    log.append(str(datetime.time(datetime.now())) + "\n")
+    log.append(timestamp + "\n")
     log.append("Routing Update\n")
     for row in routing_table:
         log.append(f"{row[0]},{row[1]}:{row[2]},{row[3]}\n")
     log.append("Routing Complete\n")
-    write_to_log(log)
+    return log
 
 # "Topology Update: Link Dead" Format is below: (Note: We do not require you to print out Link Alive log in this project)
 #
@@ -116,136 +132,60 @@ def topology_update_switch_alive(switch_id):
 
 
 def write_to_log(log):
-    with open(LOG_FILE, 'a+') as log_file:
-        log_file.write("\n\n")
-        # Write to log
-        log_file.writelines(log)
-
-def determine_number_of_switches(config_file):
-    '''Returns the number of switches'''
-    with open(config_file, 'r') as f:
-        f = f.readlines()
-        num_switches = int(f[0]) 
-
-    return num_switches
+    # Queued and written by a background thread, see log_writer.py
+    get_log_writer(LOG_FILE).write(log)
 
 def open_file(config_file,link_failure):
-    '''This function takes the filepath for a graph_n.txt file and returns a 
+    '''This function takes the filepath for a graph_n.txt file (or a binary 
+    topology file, see topology_file.py) and returns a 
     dictionary where each key is a switch id/node and the number of switches. 
     The value is a nested dictionary that has a key-value pair for each 
     neighbor where key=neighbor_id and value=link cost. 
-    ie. d = {node1:{node2:cost, node3:cost}, node2:{node3:cost}}'''
-    d = {}
+    ie. d = {node1:{node2:cost, node3:cost}, node2:{node3:cost}}
     
-    with open(config_file, 'r') as f:
-        f = f.readlines()
-        num_switches = int(f[0]) 
-          
-        # Create initial empty dictionary where link cost is zero for self and 
-        # 9999 otherwise
-        for self_id in range(num_switches):
-            d[self_id] = {}
-            for neighbor_id in range(num_switches):
-                if neighbor_id == self_id:
-                    cost = 0
-                else:
-                    cost = 9999
-                d[self_id][neighbor_id] = cost
-
-        # Now update each cost based on the config file
-        for line in f[1:]:
-            line = line.split()
-            self_id = int(line[0])
-            neighbor_id = int(line[1])
-            cost = int(line[2])
-            
-            if link_failure[self_id] == neighbor_id:
-                d[self_id][neighbor_id] = 9999
-                d[neighbor_id][self_id] = 9999
-            elif link_failure[neighbor_id] == self_id:
-                d[self_id][neighbor_id] = 9999
-                d[neighbor_id][self_id] = 9999
-            else:
-                # Update values
-                d[self_id][neighbor_id] = cost
-                d[neighbor_id][self_id] = cost
-    
-    return d
-
-
-def min_distance(distances, visited):
-    '''Function to find the node with the smallest distance that has not been 
-    visited yet'''
-    # Initialize minimum distance for next node
-    min_val = 9999
-    min_index = -1
-
-    # Loop through all nodes to find minimum distance
-    for i in range(len(distances)):
-        if distances[i] < min_val and i not in visited:
-            min_val = distances[i]
-            min_index = i
-    return min_index
+    Only real links are stored, so a switch with no usable links maps to an 
+    empty dictionary and a missing key means there is no link (infinite cost).
+    Links listed in link_failure are left out entirely.'''
+    num_switches, links = read_links(config_file)
+    return build_adjacency(num_switches, links, link_failure)
 
-
-def dijkstra(graph, live_switches, start_node):
-    num_nodes = len(graph)
-
-    distances = {node: int(9999) for node in range(num_nodes)}
-    paths = {node: [] for node in range(num_nodes)}
-    next_hop = {node: -1 for node in range(num_nodes)}
-    visited = set()
+def build_adjacency(num_switches, links, link_failure):
+    '''Returns the dictionary described in open_file() for the links read by 
+    topology_file.read_links()'''
+    d = {}
     
-    if start_node in live_switches:
-        next_hop[start_node] = start_node
-        distances[start_node] = 0
-    else:
-        next_hop[start_node] = -1
-        distances[start_node] = 9999
-
-    priority_queue = [(0, start_node)]
+    # Create initial empty adjacency for every switch
+    for self_id in range(num_switches):
+        d[self_id] = {}
 
-    while priority_queue:
-        current_distance, current_node = heapq.heappop(priority_queue)
-        if current_node not in live_switches:
+    # Now add each link from the config file
+    it = iter(links)
+    for self_id, neighbor_id, cost in zip(it, it, it):
+        if link_failure.get(self_id) == neighbor_id:
             continue
-        
-        elif current_node in visited:
+        elif link_failure.get(neighbor_id) == self_id:
             continue
-
-        visited.add(current_node)
-
-        for neighbor, weight in enumerate(graph[current_node]):
-            if weight != 0 and neighbor not in visited:
-                new_distance = distances[current_node] + weight
-
-                if new_distance < distances[neighbor]:
-                    distances[neighbor] = new_distance
-                    paths[neighbor] = paths[current_node] + [current_node]
-                    next_hop[neighbor] = current_node
-                    heapq.heappush(priority_queue, (new_distance, neighbor))
-
-    return distances, paths, next_hop
+        else:
+            # Update values
+            d[self_id][neighbor_id] = cost
+            d[neighbor_id][self_id] = cost
+    
+    return d
 
 
 def generate_response_msg(connected_switches,link_failure):
     '''connected_switches is a dictionary where the Key=switch_id and 
     value=switch_addr where switch_addr is a tuple (addr,port_number) and
     creates a response message to be sent. The response message has a format
-    where it is a list [REPONSE_TYPE, message_body].'''
+    where it is a list [REPONSE_TYPE, message_body, link_failure] where 
+    message_body is a list of (switch_id, addr, port_number) tuples.'''
     
     l = ['Register_Response']
-    num_switches = len(connected_switches)
-    
-    msg = f'{num_switches} \n'
-    count = 0
     
+    msg = []
     for switch_id,switch_addr in connected_switches.items():
         addr, port_number = switch_addr
-        msg += f'{switch_id} {addr} {port_number}'
-        if count < num_switches:
-            msg += '\n'
-        count += 1
+        msg.append((switch_id, addr, port_number))
     
     l.append(msg)
     
@@ -253,74 +193,145 @@ def generate_response_msg(connected_switches,link_failure):
     return l
 
 
-def generate_routing_table_msg(routing_table):
+def generate_routing_table_msg(routing_table, version=0):
     '''This function creates the routing table message that is sent to all 
     switches. The response message has a format where it is a list 
-    [REPONSE_TYPE, message_body] RESPONSE-TYPE == 'Routing_Update' '''
+    [REPONSE_TYPE, message_body, version] RESPONSE-TYPE == 'Routing_Update' '''
     l = ['Routing_Update']
     l.append(routing_table)
+    l.append(version)
     return l
 
 
-def send_message(socket, connected_switches, message):
-    print(f'Send Message: \n{message}')
-    message_type = message[0]
-    print(f'Message Type: {message_type}')
-    
-    if message_type == 'Register_Response':
-        message = pickle.dumps(message) # Pickle Message to be sent
-        for switch_id,switch_addr in connected_switches.items():
-            socket.sendto(message, switch_addr)
-            register_response_sent(switch_id)
-            print(f'{time.time()} -- Sent Register_Response to switch#{switch_id}')
-    
-    elif message_type == 'Routing_Update':
-        routing_table = message[1]
-        for switch_id,switch_addr in connected_switches.items():
-            switch_routing_table = ['Routing_Update']
-            l = []
-            for entry in routing_table:
-                if entry[0] == switch_id:
-                    l.append(entry[0:3])
-            switch_routing_table.append(l)
-            message = pickle.dumps(switch_routing_table) # Pickle Message to be sent
-            socket.sendto(message, switch_addr)
-            print(f'{time.time()} -- Sent Routing_Update to switch#{switch_id}')
-        
+def generate_routing_delta_msg(switch_id, version, base_version, changed, removed):
+    '''This function creates a routing table delta message for one switch. 
+    The message has a format where it is a list 
+    [REPONSE_TYPE, switch_id, version, base_version, rows, removed] 
+    RESPONSE-TYPE == 'Routing_Update_Delta'. rows holds the 
+    [<Switch ID>, <Dest ID>, <Next Hop>] entries that were added or changed 
+    and removed the destinations that are gone. The switch only applies it 
+    on top of the table with version base_version.'''
+    l = ['Routing_Update_Delta', switch_id, version, base_version]
+    l.append([[switch_id, dest_id, hop] for dest_id, hop in sorted(changed.items())])
+    l.append(removed)
+    return l
+
+
+def group_routing_table(routing_table):
+    '''Groups the routing table rows by switch and returns a dictionary 
+    where key=switch_id and value is a dictionary {dest_id: next_hop}'''
+    tables = {}
+    for row in routing_table:
+        if row[0] not in tables:
+            tables[row[0]] = {}
+        tables[row[0]][row[1]] = row[2]
+    return tables
+
+
+def diff_routing_tables(old_table, new_table):
+    '''Compares two {dest_id: next_hop} tables of one switch and returns 
+    (changed, removed) where changed is a dictionary of the destinations that 
+    were added or got a new next hop and removed is a list of the 
+    destinations that are no longer in the table.'''
+    changed = {}
+    for dest_id, hop in new_table.items():
+        if old_table.get(dest_id) != hop:
+            changed[dest_id] = hop
+    removed = [dest_id for dest_id in old_table if dest_id not in new_table]
+    return changed, removed
+
+
 class Controller:
-    def __init__(self, controller_port, config_file):
+    def __init__(self, controller_port, config_file, routing_backend='python', hold_down=0.5, routing_workers=None, cache_size=16, snapshot_file=None, bootstrap_grace=None, bootstrap_quorum=1):
         print(f'{time.time()} -- Creating controller with port number {controller_port}')
         self.controller_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.controller_hostname = socket.gethostname()
         self.controller_port = int(controller_port)
         self.controller_addr = ('0.0.0.0',self.controller_port)
         self.controller_socket.bind(self.controller_addr)
+        self.reassembler = transport.Reassembler()
         
         self.config_file = config_file
         self.d = {}
         self.d_changes = None
+        self.config_links = None # (num_switches, links) read from the config file once
+        self.config_adjacency = None # links in the config file, including failed ones
         self.total_num_switches = int()
         self.switch_addresses = {}
         self.graph = None
         self.routing_table = None
-        self.switch_statuses = {}
+        self.registered_at = {} # {switch_id: time of its last Register_Request}
         self.live_switches = set()
         self.link_failure = {}
         self.change_in_routing_table = False
         self.K = 2
         self.TIMEOUT = 3 * self.K
+        # The routes are sent once every switch registered, or BOOTSTRAP_GRACE 
+        # seconds after the first Register_Request if at least 
+        # BOOTSTRAP_QUORUM switches registered. None waits for every switch.
+        self.BOOTSTRAP_GRACE = bootstrap_grace
+        self.BOOTSTRAP_QUORUM = bootstrap_quorum
+        self.switch_liveness = LivenessTracker(self.TIMEOUT) # deadline of each live switch
+        self.routing_backend = routing_backend # 'python', 'numpy' or 'process'
+        self.parallel_routing = None # worker processes of the 'process' backend
+        if routing_backend == 'process':
+            self.parallel_routing = ParallelRouting(routing_workers)
+        self.distances = None # distances[s][d] from the last computation
+        self.next_hops = None # next_hops[s][d] from the last computation
+        self.dirty_sources = None # sources to recompute, None means all
+        self.route_cache = RouteCache(cache_size) # routes of topologies seen before
+        self.graph_digest = None # hash of graph and link_failure for the route cache, None when outdated
+        self.routing_version = 0
+        self.switch_tables = {} # {switch_id: {dest_id: next_hop}} last sent to each switch
+        self.switch_versions = {} # routing_version last sent to each switch
+        self.topology_sequences = {} # sequence of the last Topology_Update applied for each switch
+        self.snapshot_file = snapshot_file # where the state is saved for a warm restart, None to not save it
+        self.saved_state = None # state in the snapshot file
+        self.config_file_digest = None # hash of the topology the snapshot is for
+        
+        # Topology events arriving within HOLD_DOWN seconds of the first one 
+        # are merged into a single recomputation
+        self.HOLD_DOWN = hold_down
+        self.lock = threading.RLock()
+        self.pending_topology_events = 0
+        self.topology_events = 0 # topology changes received
+        self.topology_events_merged = 0 # topology changes that didn't need their own recomputation
+        self.recomputations = 0
+        
+        # Pipeline: the receiver stage decodes messages into message_queue, 
+        # the state stage applies them under the lock and wakes the route 
+        # worker through route_work. topology_generation changes with every 
+        # topology change, so the route worker can tell that the routes it 
+        # computed without the lock are already outdated.
+        self.message_queue = queue.Queue(maxsize=1024)
+        self.route_work = threading.Condition(self.lock)
+        self.recompute_wanted = False
+        self.recompute_urgent = False # skip the hold-down, a switch is waiting for its table
+        self.topology_generation = 0
+        self.messages_received = 0
+        self.messages_dropped = 0 # Topology_Updates dropped because the queue was full
+        self.receiver_blocked = 0 # times the receiver waited for room in the queue
+        self.queue_high_water = 0
+        self.queue_wait_total = 0 # seconds messages spent in the queue
+        self.queue_wait_max = 0
+        self.stale_computations = 0 # computations thrown away because the topology changed
         
         
     def create_graph(self):
         '''This function creates a graph from d that is passed into the function 
-        dijkstra_algorithm().'''
+        dijkstra(). The graph is a list of adjacency lists indexed by switch id, 
+        where each adjacency list holds (neighbor_id, cost) tuples sorted by 
+        neighbor_id, so its size grows with the number of links rather than 
+        with the square of the number of switches.'''
         self.graph = []
-        for self_id in self.d:
-            l = []
-            for cost in self.d[self_id].values():
-                l.append(cost)
+        for self_id in range(len(self.d)):
+            l = sorted(self.d[self_id].items())
             self.graph.append(l)
-        print(self.graph)
+        self.dirty_sources = None
+        self.graph_digest = None
+        self.topology_generation += 1
+        if metrics.verbose:
+            print(self.graph)
         
         
     def create_routing_table(self):
@@ -329,59 +340,83 @@ class Controller:
         of [[...], [...], ...]. Within each list in the outermost list, 
         the first element is <Switch ID>. The second is <Dest ID>, 
         and the third is <Next Hop>, and the fourth is <Shortest distance>'''
-        routing_table = []
+        if self.load_cached_routes():
+            return
+        job = self.take_routing_job()
+        self.publish_routes(job, self.compute_routes(job))
         
-        for node in range(len(self.graph)):
-            
-            # print("NODE ",node)
-            distances, paths, next_hop = dijkstra(self.graph, self.live_switches, node)
-            
-            # print(f'DISTANCES = {distances}')
-            # print(f'PATHS = {paths}')
-            # print(f'NEXT_HOP = {next_hop}')
-            for key,value in distances.items():
-                switch_id = node
-                dest_id = key
-                hop = None
-                shortest_distance = distances[key]
-                
-                # If the key (ie. node #n is in live switches act normally)
-                if key in self.live_switches:
-                    # Node is itself
-                    if paths[key] == []:
-                        # print("Empty LIST")
-                        hop = node
-                    # Next path is 
-                    elif shortest_distance == 9999:
-                        hop = -1
-                    elif len(paths[key]) == 1:
-                        hop = key
-                    else:
-                        hop = paths[key][1]
-                
-                # If the key (ie. node #n is not in live switches assign hop = -1 and distance to inf)      
-                else:
-                    hop = -1
-                    shortest_distance = 9999
-                        
-                # # if the key (ie. node-link is broken set to -1 and 9999)
-                # if (node in self.link_failure) and (key == self.link_failure[node]):
-                #     hop = -1
-                #     shortest_distance = 9999
-                #     # topology_update_link_dead(node,key)
-                
-                # elif (key in self.link_failure) and (node == self.link_failure[key]):
-                #     hop = -1
-                #     shortest_distance = 9999
-                #     # topology_update_link_dead(key,node)
-                        
-                # only create routing table for live switches
-                if node in self.live_switches:
-                    l = [switch_id] # first element of the list is Switch_ID
-                    l.append(dest_id) # second element of the list is Destination_ID
-                    l.append(hop)
-                    l.append(shortest_distance) # fourth element of the list is Shortest Distance
-                    routing_table.append(l)
+        
+    def take_routing_job(self):
+        '''Returns what compute_routes needs, copied so that the topology can 
+        keep changing while the routes are computed without the lock.'''
+        if self.distances is None or self.dirty_sources is None:
+            dirty_sources = None # Full computation
+        else:
+            dirty_sources = self.dirty_sources
+        self.dirty_sources = set()
+        return (self.topology_generation, list(self.graph), set(self.live_switches), dirty_sources)
+        
+        
+    def compute_routes(self, job):
+        '''Computes the shortest paths for a job from take_routing_job. Only 
+        reads the job, so it does not need the lock.'''
+        generation, graph, live_switches, dirty_sources = job
+        started = time.perf_counter()
+        if dirty_sources is None:
+            # Full computation
+            if self.routing_backend == 'numpy':
+                result = all_pairs_shortest_paths_numpy(graph, live_switches)
+            elif self.routing_backend == 'process':
+                result = self.parallel_routing.all_pairs_shortest_paths(graph, live_switches)
+            else:
+                result = all_pairs_shortest_paths(graph, live_switches)
+            metrics.observe('spf_full', time.perf_counter() - started)
+            return result
+        
+        # Incremental computation, only redo the sources whose shortest 
+        # paths went through something that changed
+        if metrics.verbose:
+            print(f'Recomputing {len(dirty_sources)} of {len(live_switches)} sources')
+        if self.routing_backend == 'process':
+            rows = self.parallel_routing.shortest_paths(graph, live_switches, dirty_sources)
+        else:
+            rows = {}
+            for node in dirty_sources:
+                rows[node] = dijkstra(graph, live_switches, node)
+        metrics.observe('spf_incremental', time.perf_counter() - started)
+        metrics.count('spf_sources', len(dirty_sources))
+        return rows
+        
+        
+    def publish_routes(self, job, result):
+        '''Makes the result of compute_routes the current routing table. If the 
+        topology changed since take_routing_job the result is thrown away, 
+        its sources are marked for recomputation again and False is returned.'''
+        generation, graph, live_switches, dirty_sources = job
+        if generation != self.topology_generation:
+            if dirty_sources is None:
+                self.dirty_sources = None
+            elif self.dirty_sources is not None:
+                self.dirty_sources |= dirty_sources & self.live_switches
+            return False
+        
+        if dirty_sources is None:
+            self.distances, self.next_hops = result
+        else:
+            for node, (distances, next_hops) in result.items():
+                self.distances[node] = distances
+                self.next_hops[node] = next_hops
+        self.route_cache.put(self.current_topology_key(), self.distances, self.next_hops)
+        self.update_routing_table()
+        return True
+        
+        
+    def update_routing_table(self):
+        '''Builds the routing table from the distance and next hop matrices and 
+        sets change_in_routing_table.'''
+        # only create routing table for live switches; dead or unreachable 
+        # destinations already come back with -1 and 9999
+        routing_table = routing_table_rows(self.distances, self.next_hops, self.live_switches)
                     
         if routing_table != self.routing_table:
             self.routing_table = routing_table
@@ -390,80 +425,334 @@ class Controller:
             self.change_in_routing_table = False
         
         
+    def current_topology_key(self):
+        '''Returns the route cache key of the current links and live switches'''
+        if self.graph_digest is None:
+            self.graph_digest = graph_digest(self.graph, self.link_failure)
+        return topology_key(self.graph_digest, self.live_switches)
+        
+        
+    def load_cached_routes(self):
+        '''Uses the cached routes if the current topology was seen before and 
+        returns whether it did.'''
+        cached = self.route_cache.get(self.current_topology_key())
+        if cached is None:
+            return False
+        self.distances, self.next_hops = cached
+        self.dirty_sources = set()
+        self.update_routing_table()
+        if metrics.verbose:
+            print(f'Using cached routes, route cache: {self.route_cache.stats()}')
+        return True
+        
+        
+    def mark_switch_dead(self, switch_id):
+        '''Removes switch_id from the live switches and marks only the sources 
+        whose shortest paths went through it for recomputation. The other 
+        sources just get switch_id set as unreachable.'''
+        if switch_id not in self.live_switches:
+            return
+        
+        if self.distances is not None and self.dirty_sources is not None:
+            affected = sources_affected_by_switch(self.graph, self.distances, self.live_switches, switch_id)
+            self.dirty_sources |= affected
+            num_nodes = len(self.graph)
+            for node in self.live_switches:
+                # Replace the rows instead of changing them, the route 
+                # cache may hold them
+                distances = self.distances[node][:]
+                distances[switch_id] = INFINITY
+                self.distances[node] = distances
+                next_hops = self.next_hops[node][:]
+                next_hops[switch_id] = -1
+                self.next_hops[node] = next_hops
+            self.distances[switch_id] = [INFINITY] * num_nodes
+            self.next_hops[switch_id] = [-1] * num_nodes
+            self.dirty_sources.discard(switch_id)
+        
+        self.live_switches.discard(switch_id)
+        self.topology_generation += 1
+        self.switch_liveness.remove(switch_id)
+        self.switch_tables.pop(switch_id, None)
+        
+        
+    def mark_switch_alive(self, switch_id):
+        '''Adds switch_id to the live switches. A switch coming back can give 
+        shorter paths to anyone, so every source is recomputed.'''
+        if switch_id not in self.live_switches:
+            self.live_switches.add(switch_id)
+            self.dirty_sources = None
+            self.topology_generation += 1
+        
+        
+    def update_link_cost(self, switch_id_1, switch_id_2, cost):
+        '''Changes the cost of the link between switch_id_1 and switch_id_2 
+        (cost INFINITY removes the link) and marks only the sources whose 
+        routes can change for recomputation.'''
+        old_cost = self.d[switch_id_1].get(switch_id_2, INFINITY)
+        if cost == old_cost:
+            return
+        
+        if cost >= INFINITY:
+            self.d[switch_id_1].pop(switch_id_2, None)
+            self.d[switch_id_2].pop(switch_id_1, None)
+        else:
+            self.d[switch_id_1][switch_id_2] = cost
+            self.d[switch_id_2][switch_id_1] = cost
+        self.graph[switch_id_1] = sorted(self.d[switch_id_1].items())
+        self.graph[switch_id_2] = sorted(self.d[switch_id_2].items())
+        self.graph_digest = None
+        self.topology_generation += 1
+        
+        if self.distances is not None and self.dirty_sources is not None:
+            self.dirty_sources |= sources_affected_by_link(self.distances, self.live_switches, switch_id_1, switch_id_2, old_cost, cost)
+        
+        
     def recompute_paths_and_send_update(self):
-        print(f"{time.time()} -- Controller recompute_paths_and_send_update()")
-        self.create_routing_table()
+        '''Computes the routes without holding the lock, so the state stage 
+        keeps applying messages meanwhile, then publishes them and sends the 
+        updates. Starts over if the topology changed during the computation. 
+        A topology that was seen before gets its routes from the route cache.'''
+        if metrics.verbose:
+            print(f"{time.time()} -- Controller recompute_paths_and_send_update()")
+        while True:
+            with self.lock:
+                if self.load_cached_routes():
+                    self.log_and_send_routing_table()
+                    return
+                job = self.take_routing_job()
+            result = self.compute_routes(job)
+            with self.lock:
+                if not self.publish_routes(job, result):
+                    self.stale_computations += 1
+                    metrics.count('stale_computations')
+                    if metrics.verbose:
+                        print('Topology changed during the recomputation, starting over')
+                    continue
+                self.log_and_send_routing_table()
+                return
+        
         
+    def log_and_send_routing_table(self):
         if self.change_in_routing_table == True:
             # LOG - Routing Table
             routing_table_update(self.routing_table)
-            
-            # Send Routing Table
-            routing_table_msg = generate_routing_table_msg(self.routing_table)
-            for switch_id in self.live_switches:
-                l = []
-                for entry in self.routing_table:
-                    if entry[0] == switch_id:
-                        l.append(entry[0:3])
-                routing_table_msg = generate_routing_table_msg(l)
-                message = pickle.dumps(routing_table_msg) # Pickle Message to be sent
-                self.controller_socket.sendto(message, self.switch_addresses[switch_id])
         
-            print(f'Sent routing table {routing_table_msg}')
+        # Send Routing Table, switches that registered again get 
+        # their full table even if nothing changed
+        self.send_routing_updates()
+        
+        
+    def send_routing_updates(self):
+        '''Sends each live switch only what changed in its part of the 
+        routing table since the last update it got. Switches that have no 
+        table yet get the full table, switches whose rows didn't change get 
+        nothing. The table is grouped by switch once, every message is 
+        encoded once and all datagrams go out in one batch.'''
+        started = time.time()
+        self.routing_version += 1
+        tables = group_routing_table(self.routing_table)
+        grouped = time.time()
+        
+        messages = []
+        sent = []
+        for switch_id in sorted(self.live_switches):
+            new_table = tables.get(switch_id, {})
+            if switch_id not in self.switch_tables:
+                routing_table_msg = self.generate_full_routing_msg(switch_id, new_table)
+                sent.append(f'Routing_Update to switch#{switch_id}')
+            else:
+                changed, removed = diff_routing_tables(self.switch_tables[switch_id], new_table)
+                if not changed and not removed:
+                    continue
+                routing_table_msg = generate_routing_delta_msg(switch_id, self.routing_version, self.switch_versions[switch_id], changed, removed)
+                sent.append(f'Routing_Update_Delta to switch#{switch_id} ({len(changed)} changed, {len(removed)} removed)')
+            messages.append((encode(routing_table_msg), self.switch_addresses[switch_id])) # Encode Message to be sent
+            self.switch_tables[switch_id] = new_table
+            self.switch_versions[switch_id] = self.routing_version
+        encoded = time.time()
+        
+        calls = transport.send_batch(self.controller_socket, messages)
+        done = time.time()
+        metrics.observe('fanout', done - started)
+        metrics.count('fanout_messages', len(messages))
+        if metrics.verbose:
+            for line in sent:
+                print(f'{done} -- Sent {line}')
+            print(f'{done} -- Routing fan-out: {len(sent)} switches, '
+                  f'{sum(len(data) for data, addr in messages)} encoded bytes, {calls} send calls, '
+                  f'group {(grouped - started) * 1000:.2f} ms, encode {(encoded - grouped) * 1000:.2f} ms, '
+                  f'fragment and send {(done - encoded) * 1000:.2f} ms')
+        
+        
+    def generate_full_routing_msg(self, switch_id, table):
+        '''Returns the Routing_Update message with the whole {dest_id: next_hop} 
+        table of switch_id.'''
+        l = [[switch_id, dest_id, hop] for dest_id, hop in sorted(table.items())]
+        return generate_routing_table_msg(l, self.routing_version)
+        
+        
+    def send_full_routing_update(self, switch_id):
+        '''Sends switch_id its whole part of the routing table.'''
+        # The row of switch_id, without grouping the whole table
+        table = dict(enumerate(self.next_hops[switch_id]))
+        message = encode(self.generate_full_routing_msg(switch_id, table)) # Encode Message to be sent
+        transport.send(self.controller_socket, message, self.switch_addresses[switch_id])
+        self.switch_tables[switch_id] = table
+        self.switch_versions[switch_id] = self.routing_version
+        if metrics.verbose:
+            print(f'{time.time()} -- Sent Routing_Update to switch#{switch_id}')
         
         
     def handle_register_request(self, switch_id, failed_id, recvd_addr):
         # Handle Register Request from a switch that was previosly offline
-        print(f"Controller received Register Request from Switch {switch_id}")
+        if metrics.verbose:
+            print(f"Controller received Register Request from Switch {switch_id}")
         
         hostname, port = recvd_addr
         port = int(port)
         self.switch_addresses[switch_id] = (hostname, port)
-        self.switch_statuses[switch_id] = time.time()
-        self.live_switches.add(switch_id)
+        self.switch_liveness.touch(switch_id)
+        self.registered_at[switch_id] = time.time()
+        self.mark_switch_alive(switch_id)
+        self.switch_tables.pop(switch_id, None) # The switch starts over with an empty table
+        self.topology_sequences.pop(switch_id, None) # and numbers its Topology_Updates from 1 again
         self.switch_addresses = dict(sorted(self.switch_addresses.items()))
-        self.link_failure[switch_id] = failed_id
+        old_failed_id = self.link_failure.get(switch_id)
+        if old_failed_id != failed_id:
+            # The failed link changed, only the sources whose routes can 
+            # change are recomputed
+            self.link_failure[switch_id] = failed_id
+            if old_failed_id is not None and self.link_failure.get(old_failed_id) != switch_id:
+                cost = self.config_link_costs(switch_id).get(old_failed_id)
+                if cost is not None:
+                    self.update_link_cost(switch_id, old_failed_id, cost)
+            if failed_id is not None:
+                self.update_link_cost(switch_id, failed_id, INFINITY)
         # topology_update_link_dead(switch_id,failed_id)
         
         register_request_received(switch_id)
+        
+        # Send Register Response so the switch learns its neighbors again
+        self.send_register_responses([switch_id])
 
-        # Perform recomputation of paths and send Route Update message
-        self.recompute_paths_and_send_update()
+        # Perform recomputation of paths and send Route Update message. The 
+        # switch lost its table when it restarted, so the route worker sends 
+        # it the full table even if nothing changed for the other switches.
+        self.request_recompute(urgent=True)
+    
+    def load_config(self):
+        '''Returns (num_switches, links) from the config file, which is only 
+        read the first time'''
+        if self.config_links is None:
+            self.config_links = read_links(self.config_file)
+        return self.config_links
+    
+    def read_config(self, link_failure):
+        '''Same as open_file() for the config file without reading it again'''
+        num_switches, links = self.load_config()
+        return build_adjacency(num_switches, links, link_failure)
+    
+    def config_link_costs(self, switch_id):
+        '''Returns {neighbor_id: cost} for the links of switch_id in the 
+        config file, whether or not the link failed.'''
+        if self.config_adjacency is None:
+            self.config_adjacency = self.read_config({})
+        return self.config_adjacency.get(switch_id, {})
+    
+    def config_neighbors(self, switch_id):
+        '''Returns the switches that have a link to switch_id in the config 
+        file, whether or not the link failed.'''
+        return sorted(self.config_link_costs(switch_id))
+    
+    def generate_register_response(self, switch_id):
+        '''Returns the Register_Response for switch_id. It only lists the 
+        neighbors switch_id has in the config file and their link failures, 
+        so the switch only keeps track of (and sends Keep_Alive to) real 
+        neighbors.'''
+        neighbors = [neighbor_id for neighbor_id in self.config_neighbors(switch_id) if neighbor_id in self.switch_addresses]
+        connected_switches = {neighbor_id: self.switch_addresses[neighbor_id] for neighbor_id in neighbors}
+        link_failure = {}
+        for scoped_id in [switch_id] + neighbors:
+            link_failure[scoped_id] = self.link_failure.get(scoped_id)
+        return generate_response_msg(connected_switches, link_failure)
+    
+    def send_register_responses(self, switch_ids):
+        '''Sends every switch in switch_ids its own Register_Response.'''
+        messages = []
+        for switch_id in switch_ids:
+            messages.append((encode(self.generate_register_response(switch_id)), self.switch_addresses[switch_id])) # Encode Message to be sent
+        transport.send_batch(self.controller_socket, messages)
+        for switch_id in switch_ids:
+            register_response_sent(switch_id)
+            if metrics.verbose:
+                print(f'{time.time()} -- Sent Register_Response to switch#{switch_id}')
     
     def wait_for_switches_to_come_online(self):
-        self.total_num_switches = determine_number_of_switches(self.config_file)
+        self.total_num_switches = self.load_config()[0]
     
-        # Wait for all switches to come online
+        # Wait for all switches to come online, or for the grace period. The 
+        # switches registering later are handled by handle_register_request().
         print(f'Controller is waiting for all switches to come online')
-        num_of_switches_online = 0
-        while num_of_switches_online < self.total_num_switches:
-            recvd_data, switch_addr = self.controller_socket.recvfrom(1024)
-            recvd_msg =  pickle.loads(recvd_data)
-            print(recvd_msg)
+        first_registered_at = None
+        while len(self.live_switches) < self.total_num_switches:
+            timeout = None
+            if self.BOOTSTRAP_GRACE is not None and first_registered_at is not None:
+                timeout = first_registered_at + self.BOOTSTRAP_GRACE - time.time()
+                if timeout <= 0:
+                    if len(self.live_switches) >= self.BOOTSTRAP_QUORUM:
+                        break
+                    timeout = None # keep waiting for the quorum
+            self.controller_socket.settimeout(timeout)
+            try:
+                recvd_data, switch_addr = self.controller_socket.recvfrom(transport.MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            try:
+                recvd_data = self.reassembler.feed(recvd_data, switch_addr)
+                if recvd_data is None:
+                    continue # Wait for the rest of the fragments
+                recvd_msg = decode(recvd_data)
+            except ValueError as e:
+                print(f'Dropping message from {switch_addr}: {e}')
+                continue
+            if metrics.verbose:
+                print(recvd_msg)
             request_type = recvd_msg[0]
-            switch_id = recvd_msg[1]
-            failed_id = recvd_msg[2]
+            metrics.count('received.' + request_type)
             
             if request_type == 'Register_Request':
+                switch_id = recvd_msg[1]
+                failed_id = recvd_msg[2]
                 print(f'{time.time()} -- Received {request_type} from switch {switch_id}')
                 hostname, port = switch_addr
                 port = int(port)
+                # A switch that sent its Register_Request again only updates 
+                # its address, it is not counted twice
+                new_switch = switch_id not in self.live_switches
                 self.switch_addresses[switch_id] = (hostname, port)
-                self.switch_statuses[switch_id] = time.time()
+                self.switch_liveness.touch(switch_id)
+                self.registered_at[switch_id] = time.time()
                 self.live_switches.add(switch_id)
                 self.link_failure[switch_id] = failed_id
                 register_request_received(switch_id)
-                topology_update_link_dead(switch_id,failed_id)
-                num_of_switches_online += 1
-        print('.....All Switches are Online')
+                if new_switch:
+                    topology_update_link_dead(switch_id,failed_id)
+                if first_registered_at is None:
+                    first_registered_at = time.time()
+        self.controller_socket.settimeout(None)
+        if len(self.live_switches) < self.total_num_switches:
+            missing = sorted(set(range(self.total_num_switches)) - self.live_switches)
+            print(f'.....{len(self.live_switches)} of {self.total_num_switches} switches online after the {self.BOOTSTRAP_GRACE} s grace period, missing {missing}')
+        else:
+            print('.....All Switches are Online')
         
         self.switch_addresses = dict(sorted(self.switch_addresses.items())) # sort switch_addresses
         
-        self.d = open_file(self.config_file,self.link_failure)
+        self.d = self.read_config(self.link_failure)
         
         # Send Register Response
-        response_msg = generate_response_msg(self.switch_addresses,self.link_failure)
-        send_message(self.controller_socket, self.switch_addresses, response_msg)
+        self.send_register_responses(list(self.switch_addresses))
         
         # Initial Routing Table
         self.create_graph()
@@ -472,87 +761,394 @@ class Controller:
         routing_table_update(self.routing_table)
         
         # Send Routing Table
-        routing_table_msg = generate_routing_table_msg(self.routing_table)
-        send_message(self.controller_socket, self.switch_addresses, routing_table_msg)
+        self.send_routing_updates()
+        print('Sent routing table')
+        self.save_snapshot()
+    
+    def snapshot_state(self):
+        '''Returns the state a restarted controller needs to resume, see 
+        snapshot.py'''
+        if self.config_file_digest is None:
+            self.config_file_digest = topology_digest(*self.load_config())
+        with self.lock:
+            return {
+                'config_digest': self.config_file_digest,
+                'routing_version': self.routing_version,
+                'switch_addresses': [[switch_id, addr, port] for switch_id, (addr, port) in self.switch_addresses.items()],
+                'live_switches': sorted(self.live_switches),
+                'link_failure': sorted(self.link_failure.items()),
+            }
+    
+    def save_snapshot(self):
+        '''Writes the state to the snapshot file if it changed since the 
+        last save'''
+        if self.snapshot_file is None:
+            return
+        state = self.snapshot_state()
+        if state == self.saved_state:
+            return
+        save_snapshot(self.snapshot_file, state)
+        self.saved_state = state
+    
+    def save_snapshots_periodically(self):
+        while True:
+            time.sleep(self.K)
+            try:
+                self.save_snapshot()
+            except OSError as e:
+                print(f'Could not save snapshot {self.snapshot_file}: {e}')
+    
+    def resume_from_snapshot(self):
+        '''Loads the state saved by an earlier controller and sends every live 
+        switch its routing table without waiting for the switches to register 
+        again. Returns False if there is no usable snapshot. The switches 
+        that died in the meantime time out as usual, and the Topology_Ack 
+        sent for their first Topology_Update_Delta makes the others report 
+        their full neighbor state.'''
+        if self.snapshot_file is None:
+            return False
+        if self.config_file_digest is None:
+            self.config_file_digest = topology_digest(*self.load_config())
+        state = load_snapshot(self.snapshot_file, self.config_file_digest)
+        if state is None:
+            return False
+        self.total_num_switches = self.load_config()[0]
+        self.switch_addresses = {switch_id: (addr, port) for switch_id, addr, port in state['switch_addresses']}
+        self.live_switches = set(state['live_switches'])
+        self.link_failure = {switch_id: failed_id for switch_id, failed_id in state['link_failure']}
+        self.routing_version = state['routing_version']
+        for switch_id in self.live_switches:
+            self.switch_liveness.touch(switch_id)
+        print(f'Resuming from snapshot {self.snapshot_file} saved at {state["saved_at"]}: {len(self.live_switches)} live switches')
+        
+        self.d = self.read_config(self.link_failure)
+        self.create_graph()
+        self.create_routing_table()
+        routing_table_update(self.routing_table)
+        self.send_routing_updates() # switch_tables is empty, every switch gets its full table
         print('Sent routing table')
+        self.saved_state = self.snapshot_state()
+        return True
 
         
-    def handle_topology_update(self,switch_id,neighbor_state,neighbor_status): 
-        print(f"Controller received Topology Update from Switch {switch_id}")
+    def schedule_recompute(self):
+        '''Records a topology change and wakes the route worker, which runs one 
+        recomputation HOLD_DOWN seconds after the first change of a burst. 
+        Every change that arrives in the meantime is merged into it.'''
+        with self.lock:
+            self.topology_events += 1
+            self.pending_topology_events += 1
+            self.request_recompute()
+    
+    
+    def request_recompute(self, urgent=False):
+        '''Wakes the route worker. An urgent recomputation does not wait for 
+        the hold-down window.'''
+        with self.route_work:
+            self.recompute_wanted = True
+            if urgent:
+                self.recompute_urgent = True
+            self.route_work.notify()
+    
+    
+    def route_worker(self):
+        '''Route computation stage: waits for recomputation requests, lets a 
+        burst of topology changes settle for HOLD_DOWN seconds and runs one 
+        recomputation for all of them.'''
+        while True:
+            with self.route_work:
+                while not self.recompute_wanted:
+                    self.route_work.wait()
+                deadline = time.time() + self.HOLD_DOWN
+                while not self.recompute_urgent and time.time() < deadline:
+                    self.route_work.wait(deadline - time.time())
+                self.recompute_wanted = False
+                self.recompute_urgent = False
+            self.flush_topology_events()
+    
+    
+    def flush_topology_events(self):
+        '''Runs the single recomputation for all topology changes gathered 
+        during the hold-down window.'''
+        with self.lock:
+            if self.pending_topology_events > 0:
+                self.topology_events_merged += self.pending_topology_events - 1
+                self.pending_topology_events = 0
+            self.recomputations += 1
+            metrics.count('recomputations')
+            if metrics.verbose:
+                print(f'{time.time()} -- Recomputation #{self.recomputations}: {self.topology_events} topology events received, {self.topology_events_merged} merged')
+                print(f'{time.time()} -- Pipeline: {self.pipeline_metrics()}')
+                print(f'{time.time()} -- Route cache: {self.route_cache.stats()}')
+        self.recompute_paths_and_send_update()
+    
+    
+    def handle_topology_update(self,switch_id,sequence,neighbor_state,recvd_addr): 
+        '''neighbor_state holds either every neighbor of switch_id or, for a 
+        Topology_Update_Delta, only the neighbors that changed. Updates that 
+        change something are acknowledged so that the next delta of the 
+        switch starts from this one.'''
+        if metrics.verbose:
+            print(f"Controller received Topology Update from Switch {switch_id}")
+        
+        if switch_id in self.live_switches:
+            self.switch_liveness.touch(switch_id)
+        if sequence <= self.topology_sequences.get(switch_id, 0):
+            # Reordered or duplicated, a newer update was already applied
+            self.check_timeouts()
+            return
+        self.topology_sequences[switch_id] = sequence
+        if neighbor_state:
+            transport.send(self.controller_socket, encode(['Topology_Ack', sequence]), recvd_addr)
             
         # print(f'Neighbor State = {neighbor_state}')
-        # print(f'Neighbor Status = {neighbor_status}')
         # First update switch statuses from neighbor statuses
         for key,value in neighbor_state.items():
             if value == True:
-                self.switch_statuses[key] = time.time()
+                if key in self.live_switches:
+                    self.switch_liveness.touch(key)
                 continue
             elif value == False:
-                self.live_switches.discard(key)
-                topology_update_switch_dead(switch_id)
-                self.recompute_paths_and_send_update()
-            
-        self.switch_statuses[switch_id] = time.time()
-        
-        # Check if timeout
-        for switch, value in self.switch_statuses.items():
-            if value  < time.time() - self.TIMEOUT:
-                print(f'Timeout detected by controller... from switch_statuses sent by switch {switch_id}')
-                print(f'{self.switch_statuses}')
-                print(f'!!! Switch {switch_id} is dead')
-                self.live_switches.discard(switch)
+                if self.link_failure.get(key) == switch_id or self.link_failure.get(switch_id) == key:
+                    # The link between them failed, so the Keep_Alives stopped 
+                    # but key may well be alive. The neighbor learned about 
+                    # the failure only if it registered after it.
+                    continue
+                # Several neighbors report the same dead switch, only the 
+                # first report changes anything. A neighbor keeps reporting 
+                # False until it hears from a restarted switch, so reports 
+                # within TIMEOUT of a registration are stale.
+                if key in self.live_switches and time.time() - self.registered_at.get(key, 0) > self.TIMEOUT:
+                    self.mark_switch_dead(key)
+                    topology_update_switch_dead(key)
+                    self.schedule_recompute()
+                else:
+                    with self.lock:
+                        self.topology_events += 1
+                        self.topology_events_merged += 1
+        
+        self.check_timeouts()
+    
+    
+    def check_timeouts(self):
+        '''Marks the switches that have not been heard from for TIMEOUT seconds 
+        as dead. Only the switches whose deadline passed are looked at.'''
+        for switch in self.switch_liveness.expired():
+            if switch in self.live_switches:
+                print(f'Timeout detected by controller... Switch {switch} was last heard from {self.TIMEOUT} seconds ago')
+                print(f'!!! Switch {switch} is dead')
+                self.mark_switch_dead(switch)
                 topology_update_switch_dead(switch)
 
                 # Perform recomputation of paths and send Route Update message
-                self.recompute_paths_and_send_update()
+                self.schedule_recompute()
                 
     
-    def handle_recv_message(self, recvd_data, recvd_addr):
-        recvd_msg =  pickle.loads(recvd_data)
+    def handle_message(self, recvd_msg, recvd_addr):
         request_type = recvd_msg[0]
         
-        print(f'Recevied a {request_type} from {recvd_addr}')
+        if metrics.verbose:
+            print(f'Recevied a {request_type} from {recvd_addr}')
         if request_type == 'Topology_Update':
             '''If a controller receives a Topology Update message from a switch 
             that indicates a neighbor is no longer reachable, then the controller 
             updates its topology to reflect that link as unusable.'''
             switch_id = int(recvd_msg[1])
-            neighbor_state = recvd_msg[2] # dictionary with key as switch_id and Boolean as values
-            neighbor_status = recvd_msg[3]
-            self.handle_topology_update(switch_id,neighbor_state,neighbor_status)
+            sequence = recvd_msg[2]
+            neighbor_state = recvd_msg[3] # dictionary with key as switch_id and Boolean as values
+            self.handle_topology_update(switch_id,sequence,neighbor_state,recvd_addr)
+        
+        elif request_type == 'Topology_Update_Delta':
+            '''Only the neighbors whose state changed since the update the 
+            controller acknowledged last (base_sequence).'''
+            switch_id = int(recvd_msg[1])
+            sequence = recvd_msg[2]
+            base_sequence = recvd_msg[3]
+            changes = recvd_msg[4]
+            if base_sequence > self.topology_sequences.get(switch_id, 0):
+                # The controller never applied the base update, ask for the 
+                # full neighbor state
+                if switch_id in self.live_switches:
+                    self.switch_liveness.touch(switch_id)
+                transport.send(self.controller_socket, encode(['Topology_Ack', 0]), recvd_addr)
+            else:
+                self.handle_topology_update(switch_id,sequence,changes,recvd_addr)
         
         elif request_type == 'Register_Request':
             '''If a controller receives a Register Request message from a switch 
             it previously considered as ‘dead’, then it responds appropriately 
             and marks it as ‘alive’.'''
             switch_id = int(recvd_msg[1])
-            failed_id = int(recvd_msg[2])
+            failed_id = recvd_msg[2] # None if the switch has no failed link
             self.handle_register_request(switch_id, failed_id,recvd_addr)
         
+        elif request_type == 'Routing_Resync':
+            '''If a switch could not apply a Routing_Update_Delta (it missed an 
+            earlier update) it asks for its full routing table again.'''
+            switch_id = int(recvd_msg[1])
+            if switch_id in self.live_switches and self.routing_table is not None:
+                self.send_full_routing_update(switch_id)
+        
     def receive_messages(self):
+        '''Receiver stage: reads, reassembles and decodes datagrams and queues 
+        the messages for the state stage. It never takes the lock, so the 
+        socket keeps being drained while routes are recomputed.'''
         while True:
-            print('Waiting for Message..')
-            recvd_data, addr = self.controller_socket.recvfrom(1024)
-            self.handle_recv_message(recvd_data, addr)
+            recvd_data, addr = self.controller_socket.recvfrom(transport.MAX_DATAGRAM)
+            try:
+                recvd_data = self.reassembler.feed(recvd_data, addr)
+                if recvd_data is None:
+                    continue # Wait for the rest of the fragments
+                started = time.perf_counter()
+                recvd_msg = decode(recvd_data)
+            except ValueError as e:
+                metrics.count('dropped.decode')
+                print(f'Dropping message from {addr}: {e}')
+                continue
+            metrics.observe('decode', time.perf_counter() - started)
+            metrics.count('received.' + recvd_msg[0])
+            self.enqueue_message(recvd_msg, addr)
+    
+    def enqueue_message(self, recvd_msg, recvd_addr):
+        '''Hands a message to the state stage. When the queue is full a 
+        Topology_Update is dropped, the switch sends the changes again K 
+        seconds later until they are acknowledged. Other messages wait for 
+        room.'''
+        self.messages_received += 1
+        item = (time.time(), recvd_msg, recvd_addr)
+        if recvd_msg[0] in ('Topology_Update', 'Topology_Update_Delta'):
+            try:
+                self.message_queue.put_nowait(item)
+            except queue.Full:
+                self.messages_dropped += 1
+                return
+        else:
+            if self.message_queue.full():
+                self.receiver_blocked += 1
+            self.message_queue.put(item)
+        self.queue_high_water = max(self.queue_high_water, self.message_queue.qsize())
+    
+    def process_messages(self):
+        '''State stage: applies the queued messages to the topology and 
+        liveness state and checks for timed out switches.'''
+        while True:
+            if metrics.verbose:
+                print('Waiting for Message..')
+            # Wake up when the next switch can time out even if nothing arrives
+            deadline = self.switch_liveness.next_deadline()
+            timeout = None
+            if deadline is not None:
+                timeout = max(0.01, deadline - time.time())
+            try:
+                enqueued_at, recvd_msg, recvd_addr = self.message_queue.get(timeout=timeout)
+            except queue.Empty:
+                with self.lock:
+                    self.check_timeouts()
+                continue
+            wait = time.time() - enqueued_at
+            self.queue_wait_total += wait
+            self.queue_wait_max = max(self.queue_wait_max, wait)
+            metrics.observe('queue_wait', wait)
+            with self.lock:
+                self.handle_message(recvd_msg, recvd_addr)
+    
+    def pipeline_metrics(self):
+        '''Returns a summary of the queue between the receiver and state stages'''
+        processed = self.messages_received - self.messages_dropped - self.message_queue.qsize()
+        average_wait = self.queue_wait_total / processed if processed > 0 else 0
+        return (f'{self.messages_received} received, {self.messages_dropped} dropped, '
+                f'{self.receiver_blocked} blocked, queue {self.message_queue.qsize()}/{self.message_queue.maxsize} '
+                f'(high water {self.queue_high_water}), wait avg {average_wait * 1000:.2f} ms '
+                f'max {self.queue_wait_max * 1000:.2f} ms, {self.stale_computations} stale computations')
+    
+    def register_gauges(self):
+        '''Makes the controller state part of the metrics snapshot'''
+        metrics.gauge('live_switches', lambda: len(self.live_switches))
+        metrics.gauge('routing_version', lambda: self.routing_version)
+        metrics.gauge('topology_events', lambda: self.topology_events)
+        metrics.gauge('topology_events_merged', lambda: self.topology_events_merged)
+        metrics.gauge('message_queue', self.message_queue.qsize)
+        metrics.gauge('message_queue_high_water', lambda: self.queue_high_water)
+        metrics.gauge('messages_dropped', lambda: self.messages_dropped)
+        metrics.gauge('receiver_blocked', lambda: self.receiver_blocked)
+        metrics.gauge('reassembly_expired', lambda: self.reassembler.expired)
+        metrics.gauge('route_cache_entries', lambda: len(self.route_cache))
+        metrics.gauge('route_cache_hits', lambda: self.route_cache.hits)
+        metrics.gauge('route_cache_misses', lambda: self.route_cache.misses)
+        metrics.gauge('route_cache_evictions', lambda: self.route_cache.evictions)
+        metrics.gauge('sent', transport.sent_snapshot)
     
     def run(self):
-        # Start threads for Keep Alive, Topology Update, and Timeout Handling
-        threading.Thread(target=self.receive_messages, args=(), daemon=False).start()
+        # Start threads for the receiver, state and route computation stages
+        threading.Thread(target=self.receive_messages, args=(), daemon=True).start()
+        threading.Thread(target=self.route_worker, args=(), daemon=True).start()
+        if self.snapshot_file is not None:
+            threading.Thread(target=self.save_snapshots_periodically, args=(), daemon=True).start()
+        threading.Thread(target=self.process_messages, args=(), daemon=False).start()
         
 
 def main():
     #Check for number of arguments and exit if host/port not provided
     num_args = len(sys.argv)
     if num_args < 3:
-        print ("Usage: python controller.py <port> <config file>\n")
+        print ("Usage: python controller.py <port> <config file> [-b python|numpy|process] [-j routing workers] [-w hold-down seconds] [-c route cache entries] [-s snapshot file] [-g bootstrap grace seconds] [-q bootstrap quorum] [-m stats port] [-v]\n")
         sys.exit(1)
     
     #Write your code below or elsewhere in this file
     controller_port = int(sys.argv[1])
     config_file = sys.argv[2]
     
-    controller = Controller(controller_port,config_file)
-    controller.wait_for_switches_to_come_online()
+    # Process command line inputs for -b flag (routing backend)
+    routing_backend = 'python'
+    if "-b" in sys.argv:
+        routing_backend_index = sys.argv.index("-b") + 1
+        routing_backend = sys.argv[routing_backend_index]
+    
+    # Process command line inputs for -j flag (worker processes of the process backend)
+    routing_workers = None
+    if "-j" in sys.argv:
+        routing_workers_index = sys.argv.index("-j") + 1
+        routing_workers = int(sys.argv[routing_workers_index])
+    
+    # Process command line inputs for -w flag (hold-down window in seconds)
+    hold_down = 0.5
+    if "-w" in sys.argv:
+        hold_down_index = sys.argv.index("-w") + 1
+        hold_down = float(sys.argv[hold_down_index])
+    
+    # Process command line inputs for -c flag (route cache size, 0 disables it)
+    cache_size = 16
+    if "-c" in sys.argv:
+        cache_size_index = sys.argv.index("-c") + 1
+        cache_size = int(sys.argv[cache_size_index])
+    
+    # Process command line inputs for -s flag (snapshot file for warm restarts)
+    snapshot_file = None
+    if "-s" in sys.argv:
+        snapshot_file_index = sys.argv.index("-s") + 1
+        snapshot_file = sys.argv[snapshot_file_index]
+    
+    # Process command line inputs for -g and -q flags (send the routes -g 
+    # seconds after the first registration if at least -q switches registered)
+    bootstrap_grace = None
+    if "-g" in sys.argv:
+        bootstrap_grace_index = sys.argv.index("-g") + 1
+        bootstrap_grace = float(sys.argv[bootstrap_grace_index])
+    bootstrap_quorum = 1
+    if "-q" in sys.argv:
+        bootstrap_quorum_index = sys.argv.index("-q") + 1
+        bootstrap_quorum = int(sys.argv[bootstrap_quorum_index])
+    
+    # -v prints every message, -m serves the metrics on a local UDP port
+    metrics.verbose = "-v" in sys.argv
+    
+    controller = Controller(controller_port,config_file,routing_backend,hold_down,routing_workers,cache_size,snapshot_file,bootstrap_grace,bootstrap_quorum)
+    if "-m" in sys.argv:
+        stats_port_index = sys.argv.index("-m") + 1
+        controller.register_gauges()
+        metrics.serve(int(sys.argv[stats_port_index]))
+    if not controller.resume_from_snapshot():
+        controller.wait_for_switches_to_come_online()
     
     controller.run()
     
@@ -563,7 +1159,7 @@ if __name__ == "__main__":
     # config_file = 'Config/graph_3.txt'
     # controller = Controller(1094,config_file)
     
-    # controller.total_num_switches = determine_number_of_switches(config_file)
+    # controller.total_num_switches = controller.load_config()[0]
     # addr1 = ('localhost',2222)
     # addr2 = ('localhost',2223)
     # addr3 = ('localhost',2224)
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+
+"""End-to-end convergence benchmark on localhost for ECE50863 Lab Project 1
+
+Usage: python convergence_benchmark.py <config file> [-p port] [-k <time>:<Id_self> ...] [-r <time>:<Id_self> ...]
+                                       [-f <time>:<Id_self>:<Id_neighbor> ...] [-w settle seconds] [-a "controller args"] [-o results.json]
+
+Starts controller.py and one switch.py process per switch of the config
+file (e.g. Config/graph_6.txt) in a temporary directory, waits until every
+switch logged its first Routing Update and then runs the schedule, with
+times in seconds after that point:
+
+    -k 5:2      kills switch 2 (SIGKILL) 5 seconds in
+    -r 20:2     restarts switch 2 20 seconds in
+    -f 35:1:0   restarts switch 1 with -f 0 (its link to switch 0 failed)
+
+For every event it reports when the controller noticed it (Switch Dead or
+Register Request in Controller.log), the time to convergence (from the
+event to the last switch that logged a Routing Update before the next
+event), how many switches got an update, and the messages and bytes sent
+per message type in that window. The message counts come from the
+TRANSPORT_STATS_DIR files written by transport.py. The run ends -w seconds
+after the last event.
+
+A result only means something if the controller ended up with the right
+switches alive, so every Switch Dead logged for a switch the event did not
+kill is reported as a false death, and at the end the live switches in
+Controller.log are compared with the switches that were running. Any
+difference is printed and the exit status is 2.
+"""
+
+import glob
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from topology_file import read_num_switches
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+TIMESTAMP = re.compile(r'^\d\d:\d\d:\d\d(\.\d+)?$')
+STARTUP_TIMEOUT = 60 # seconds to wait for the first routing tables
+
+
+def log_time(text, reference):
+    '''The logs only have the time of day, returns it in seconds since the
+    epoch on the day closest to reference.'''
+    day = datetime.fromtimestamp(reference).date()
+    timestamp = datetime.combine(day, datetime.strptime(text, '%H:%M:%S.%f' if '.' in text else '%H:%M:%S').time()).timestamp()
+    if timestamp - reference > 12 * 3600:
+        timestamp -= 24 * 3600
+    elif reference - timestamp > 12 * 3600:
+        timestamp += 24 * 3600
+    return timestamp
+
+
+def read_log(log_file, reference):
+    '''Returns the (timestamp, first line) of every entry of a log file'''
+    try:
+        with open(log_file, 'r') as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return []
+    entries = []
+    for i in range(len(lines) - 1):
+        if TIMESTAMP.match(lines[i]):
+            entries.append((log_time(lines[i], reference), lines[i + 1].strip()))
+    return entries
+
+
+class Emulation:
+    '''The controller and switch processes of one run'''
+    def __init__(self, config_file, port, directory, controller_args):
+        self.config_file = os.path.abspath(config_file)
+        self.port = port
+        self.directory = directory
+        self.controller_args = controller_args
+        self.stats_dir = os.path.join(directory, 'stats')
+        os.mkdir(self.stats_dir)
+        self.num_switches = read_num_switches(self.config_file)
+        self.controller = None
+        self.switches = {} # {switch_id: Popen}
+        self.roles = {} # {pid: 'controller' or 'switch'}
+        self.started_at = time.time()
+
+
+    def launch(self, name, args, role):
+        env = dict(os.environ, TRANSPORT_STATS_DIR=self.stats_dir)
+        with open(os.path.join(self.directory, name + '.out'), 'a') as out:
+            process = subprocess.Popen([sys.executable, '-u'] + args, cwd=self.directory, env=env,
+                                       stdout=out, stderr=subprocess.STDOUT)
+        self.roles[process.pid] = role
+        return process
+
+
+    def start_controller(self):
+        self.controller = self.launch('controller', [os.path.join(SOURCE_DIR, 'controller.py'), str(self.port), self.config_file] + self.controller_args, 'controller')
+
+
+    def start_switch(self, switch_id, failed_neighbor=None):
+        args = [os.path.join(SOURCE_DIR, 'switch.py'), str(switch_id), 'localhost', str(self.port)]
+        if failed_neighbor is not None:
+            args += ['-f', str(failed_neighbor)]
+        self.switches[switch_id] = self.launch(f'switch{switch_id}', args, 'switch')
+
+
+    def kill_switch(self, switch_id):
+        process = self.switches.pop(switch_id, None)
+        if process is not None:
+            process.kill()
+            process.wait()
+
+
+    def stop(self):
+        '''Interrupts every process so the logs and counters get flushed'''
+        processes = list(self.switches.values())
+        if self.controller is not None:
+            processes.append(self.controller)
+        for process in processes:
+            process.send_signal(signal.SIGINT)
+        for process in processes:
+            try:
+                process.wait(timeout=3)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+
+    def switch_log(self, switch_id):
+        return read_log(os.path.join(self.directory, f'switch{switch_id}.log'), self.started_at)
+
+
+    def controller_log(self):
+        return read_log(os.path.join(self.directory, 'Controller.log'), self.started_at)
+
+
+    def routing_updates(self):
+        '''Returns the timestamps of the Routing Updates logged by the switches'''
+        updates = []
+        for switch_id in range(self.num_switches):
+            for timestamp, entry in self.switch_log(switch_id):
+                if entry.startswith('Routing Update'):
+                    updates.append((timestamp, switch_id))
+        return updates
+
+
+    def wait_for_routing_tables(self):
+        '''Waits until every switch logged a Routing Update and returns when
+        the last one did, or None on timeout.'''
+        deadline = time.time() + STARTUP_TIMEOUT
+        while time.time() < deadline:
+            first_updates = {}
+            for timestamp, switch_id in self.routing_updates():
+                first_updates[switch_id] = min(timestamp, first_updates.get(switch_id, timestamp))
+            if len(first_updates) == self.num_switches:
+                return max(first_updates.values())
+            time.sleep(0.2)
+        return None
+
+
+    def message_stats(self):
+        '''Returns {role: {message type: [messages, datagrams, bytes]}} summed
+        over every process of the run so far.'''
+        totals = {}
+        for stats_file in glob.glob(os.path.join(self.stats_dir, '*.json')):
+            try:
+                with open(stats_file, 'r') as f:
+                    stats = json.load(f)
+            except (OSError, ValueError):
+                continue
+            role = totals.setdefault(self.roles.get(stats['pid'], 'other'), {})
+            for message_type, counts in stats['sent'].items():
+                entry = role.setdefault(message_type, [0, 0, 0])
+                for i in range(3):
+                    entry[i] += counts[i]
+        return totals
+
+
+def subtract_stats(after, before):
+    '''Returns the messages sent between two message_stats() snapshots,
+    summed over the roles'''
+    window = {}
+    for role, types in after.items():
+        for message_type, counts in types.items():
+            earlier = before.get(role, {}).get(message_type, [0, 0, 0])
+            entry = window.setdefault(message_type, [0, 0, 0])
+            for i in range(3):
+                entry[i] += counts[i] - earlier[i]
+    return {message_type: counts for message_type, counts in window.items() if counts[0] > 0}
+
+
+def parse_schedule(argv):
+    '''Returns the sorted list of (time, action, switch_id, failed_neighbor)'''
+    schedule = []
+    for i, arg in enumerate(argv):
+        if arg == '-k':
+            at, switch_id = argv[i + 1].split(':')
+            schedule.append((float(at), 'kill', int(switch_id), None))
+        elif arg == '-r':
+            at, switch_id = argv[i + 1].split(':')
+            schedule.append((float(at), 'restart', int(switch_id), None))
+        elif arg == '-f':
+            at, switch_id, failed_neighbor = argv[i + 1].split(':')
+            schedule.append((float(at), 'fail', int(switch_id), int(failed_neighbor)))
+    schedule.sort()
+    return schedule
+
+
+def run_event(emulation, action, switch_id, failed_neighbor):
+    if action == 'kill':
+        emulation.kill_switch(switch_id)
+    else:
+        emulation.kill_switch(switch_id)
+        emulation.start_switch(switch_id, failed_neighbor)
+
+
+def measure_event(emulation, event, window_end, stats):
+    '''Returns the result for one event from the logs written between the
+    event and window_end.'''
+    at, action, switch_id, failed_neighbor, happened_at = event
+    expected = f'Switch Dead {switch_id}' if action == 'kill' else f'Register Request {switch_id}'
+    detected_at = None
+    for timestamp, entry in emulation.controller_log():
+        if happened_at <= timestamp < window_end and entry == expected:
+            detected_at = timestamp
+            break
+    false_dead = set()
+    for timestamp, entry in emulation.controller_log():
+        if happened_at <= timestamp < window_end and entry.startswith('Switch Dead '):
+            dead_id = int(entry.split()[2])
+            if not (action == 'kill' and dead_id == switch_id):
+                false_dead.add(dead_id)
+    updates = [(timestamp, updated) for timestamp, updated in emulation.routing_updates() if happened_at <= timestamp < window_end]
+    converged_at = max(timestamp for timestamp, updated in updates) if updates else None
+    return {
+        'time': at,
+        'action': action,
+        'switch': switch_id,
+        'failed_neighbor': failed_neighbor,
+        'detection_s': None if detected_at is None else detected_at - happened_at,
+        'convergence_s': None if converged_at is None else converged_at - happened_at,
+        'switches_updated': len({updated for timestamp, updated in updates}),
+        'false_dead': sorted(false_dead),
+        'messages': stats,
+    }
+
+
+def controller_dead_switches(emulation):
+    '''Returns the switches the controller considers dead at the end of the
+    run, from the Switch Dead and Register Request entries of its log'''
+    dead = set()
+    for timestamp, entry in emulation.controller_log():
+        if entry.startswith('Switch Dead '):
+            dead.add(int(entry.split()[2]))
+        elif entry.startswith('Register Request '):
+            dead.discard(int(entry.split()[2]))
+    return dead
+
+
+def print_messages(messages, indent='    '):
+    for message_type, (count, datagrams, num_bytes) in sorted(messages.items()):
+        print(f'{indent}{message_type:<22}{count:>8} messages{datagrams:>8} datagrams{num_bytes:>11} bytes')
+
+
+def seconds(value):
+    return 'n/a' if value is None else f'{value:.3f} s'
+
+
+def main():
+    if len(sys.argv) < 2:
+        print('Usage: python convergence_benchmark.py <config file> [-p port] [-k <time>:<Id_self> ...] [-r <time>:<Id_self> ...] '
+              '[-f <time>:<Id_self>:<Id_neighbor> ...] [-w settle seconds] [-a "controller args"] [-o results.json]\n')
+        sys.exit(1)
+
+    config_file = sys.argv[1]
+    port = 50863
+    if "-p" in sys.argv:
+        port = int(sys.argv[sys.argv.index("-p") + 1])
+    settle = 15
+    if "-w" in sys.argv:
+        settle = float(sys.argv[sys.argv.index("-w") + 1])
+    controller_args = []
+    if "-a" in sys.argv:
+        controller_args = sys.argv[sys.argv.index("-a") + 1].split()
+    schedule = parse_schedule(sys.argv)
+
+    directory = tempfile.mkdtemp(prefix='convergence.')
+    emulation = Emulation(config_file, port, directory, controller_args)
+    print(f'Running {emulation.num_switches} switches from {config_file} in {directory}')
+
+    events = []
+    running = set()
+    try:
+        emulation.start_controller()
+        time.sleep(0.5)
+        for switch_id in range(emulation.num_switches):
+            emulation.start_switch(switch_id)
+        ready_at = emulation.wait_for_routing_tables()
+        if ready_at is None:
+            print(f'Not every switch got a routing table within {STARTUP_TIMEOUT} seconds, see {directory}')
+            sys.exit(1)
+        bootstrap = ready_at - emulation.started_at
+        print(f'Every switch has a routing table {bootstrap:.3f} s after the controller started')
+
+        snapshots = [emulation.message_stats()]
+        for at, action, switch_id, failed_neighbor in schedule:
+            delay = ready_at + at - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            print(f'{at:>7.1f} s: {action} switch {switch_id}' + ('' if failed_neighbor is None else f' with -f {failed_neighbor}'))
+            snapshots.append(emulation.message_stats())
+            happened_at = time.time()
+            run_event(emulation, action, switch_id, failed_neighbor)
+            events.append((at, action, switch_id, failed_neighbor, happened_at))
+        time.sleep(settle)
+        running = set(emulation.switches)
+    finally:
+        emulation.stop()
+    ended_at = time.time()
+    snapshots.append(emulation.message_stats())
+
+    results = []
+    for i, event in enumerate(events):
+        window_end = events[i + 1][4] if i + 1 < len(events) else ended_at
+        results.append(measure_event(emulation, event, window_end, subtract_stats(snapshots[i + 2], snapshots[i + 1])))
+
+    print(f'\n{"time":>7}  {"event":<22}{"detection":>12}{"convergence":>14}{"updated":>9}  false dead')
+    for result in results:
+        event = f'{result["action"]} {result["switch"]}' + ('' if result['failed_neighbor'] is None else f' -f {result["failed_neighbor"]}')
+        false_dead = ','.join(map(str, result['false_dead'])) or '-'
+        print(f'{result["time"]:>7.1f}  {event:<22}{seconds(result["detection_s"]):>12}{seconds(result["convergence_s"]):>14}{result["switches_updated"]:>9}  {false_dead}')
+        print_messages(result['messages'])
+    
+    # The controller should end up with exactly the running switches alive
+    dead = controller_dead_switches(emulation)
+    wrongly_dead = sorted(dead & running)
+    missed = sorted(set(range(emulation.num_switches)) - running - dead)
+    if wrongly_dead:
+        print(f'\nWARNING: the controller considers running switches {wrongly_dead} dead, the results above are not valid')
+    if missed:
+        print(f'\nWARNING: the controller never noticed that switches {missed} were killed')
+
+    totals = snapshots[-1]
+    for role in sorted(totals):
+        print(f'\nSent by the {role} over the whole run:')
+        print_messages(totals[role])
+
+    if "-o" in sys.argv:
+        output_file = sys.argv[sys.argv.index("-o") + 1]
+        report = {
+            'config_file': config_file,
+            'switches': emulation.num_switches,
+            'controller_args': controller_args,
+            'bootstrap_s': bootstrap,
+            'events': results,
+            'wrongly_dead': wrongly_dead,
+            'missed_dead': missed,
+            'messages': totals,
+            'directory': directory,
+        }
+        with open(output_file, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f'\nSaved results to {output_file}')
+    if wrongly_dead or missed:
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+"""Converts topologies between the graph_n.txt format and the binary format for ECE50863 Lab Project 1
+
+Usage: python convert_config.py <input file> <output file> [-t]
+
+The input can be in either format. The output is binary, or text with -t.
+controller.py reads both, see topology_file.py.
+"""
+
+import os
+import sys
+import time
+
+from topology_file import read_links, write_binary_links, write_text_links
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: python convert_config.py <input file> <output file> [-t]\n")
+        sys.exit(1)
+    input_file = sys.argv[1]
+    output_file = sys.argv[2]
+
+    started = time.perf_counter()
+    num_switches, links = read_links(input_file)
+    read_seconds = time.perf_counter() - started
+    if "-t" in sys.argv:
+        write_text_links(output_file, num_switches, links)
+    else:
+        write_binary_links(output_file, num_switches, links)
+    print(f'{num_switches} switches and {len(links) // 3} links read from {input_file} in {read_seconds * 1000:.1f} ms, '
+          f'wrote {output_file} ({os.path.getsize(output_file)} bytes)')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""Runs every switch of a topology in one process for ECE50863 Lab Project 1
+
+Usage: python emulate.py <Controller hostname> <Controller Port> <config file> [-q] [-v] [-m <stats port>] [-f <Id_self>:<Id_neighbor> ...]
+
+Instead of starting one `python switch.py <Id_self> ...` process per switch,
+this creates a Switch object for every switch listed in the config file
+(e.g. Config/graph_6.txt) and runs all of them on a single asyncio event loop.
+Each switch keeps its own UDP socket and writes its own switch#.log, so the
+controller and the logs cannot tell the difference. -f gives a switch a
+failed link like switch.py -f does, -q silences all prints and -v adds the
+per-message ones. -m serves the metrics of all switches together, like
+switch.py -m.
+"""
+
+import asyncio
+import os
+import sys
+
+import metrics
+from switch import Switch
+from topology_file import read_num_switches
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def raise_open_file_limit(num_switches):
+    '''Every switch needs a socket and a log file, so make sure the process
+    may open that many files.'''
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = 2 * num_switches + 64
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        if hard != resource.RLIM_INFINITY:
+            needed = min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+        print(f'Raised open file limit from {soft} to {needed}')
+
+
+async def run_switches(switches):
+    for switch in switches:
+        await switch.start()
+    print(f'Started {len(switches)} switches')
+    await asyncio.Event().wait()
+
+
+def main():
+    num_args = len(sys.argv)
+    if num_args < 4:
+        print ("emulate.py <Controller hostname> <Controller Port> <config file> [-q] [-v] [-m <stats port>] [-f <Id_self>:<Id_neighbor> ...]\n")
+        sys.exit(1)
+
+    controller_addr = (sys.argv[1], int(sys.argv[2]))
+    config_file = sys.argv[3]
+
+    # Process command line inputs for -f flags
+    failed_neighbors = {}
+    for i, arg in enumerate(sys.argv):
+        if arg == "-f":
+            switch_id, failed_neighbor = sys.argv[i + 1].split(':')
+            failed_neighbors[int(switch_id)] = int(failed_neighbor)
+
+    num_switches = read_num_switches(config_file)
+    raise_open_file_limit(num_switches)
+
+    switches = []
+    for switch_id in range(num_switches):
+        switches.append(Switch(switch_id, controller_addr, failed_neighbors.get(switch_id)))
+
+    metrics.verbose = "-v" in sys.argv
+    if "-m" in sys.argv:
+        metrics.gauge('switches', lambda: len(switches))
+        metrics.serve(int(sys.argv[sys.argv.index("-m") + 1]))
+
+    if "-q" in sys.argv:
+        sys.stdout = open(os.devnull, 'w')
+
+    asyncio.run(run_switches(switches))
+
+
+if __name__ == "__main__":
+    main()
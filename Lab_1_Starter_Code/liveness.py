@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""Deadline tracking for neighbor and switch liveness in ECE50863 Lab Project 1
+
+Used by the Switch for its neighbors and by the Controller for the switches.
+Instead of scanning every last-heard timestamp on each check, every tracked
+switch has a deadline (last heard + timeout) kept in a min-heap. Hearing
+from a switch only moves its deadline in a dictionary; the heap entry is
+refreshed lazily when it reaches the top. Finding the expired switches is
+then O(expired log n) instead of O(n).
+"""
+
+import heapq
+import time
+
+
+class LivenessTracker:
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.deadlines = {} # {switch_id: deadline}
+        self.heap = [] # (deadline, switch_id), at most one entry per switch
+        self.queued = set() # switch ids that have an entry in the heap
+
+
+    def touch(self, switch_id, now=None):
+        '''Records that switch_id was heard from at now.'''
+        if now is None:
+            now = time.time()
+        deadline = now + self.timeout
+        self.deadlines[switch_id] = deadline
+        if switch_id not in self.queued:
+            self.queued.add(switch_id)
+            heapq.heappush(self.heap, (deadline, switch_id))
+
+
+    def remove(self, switch_id):
+        '''Stops tracking switch_id, its heap entry is dropped when popped.'''
+        self.deadlines.pop(switch_id, None)
+
+
+    def expired(self, now=None):
+        '''Returns the switches whose deadline passed and stops tracking them.'''
+        if now is None:
+            now = time.time()
+        expired = []
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            deadline, switch_id = heapq.heappop(heap)
+            current = self.deadlines.get(switch_id)
+            if current is None:
+                # Removed
+                self.queued.discard(switch_id)
+            elif current > now:
+                # Heard from since this entry was pushed
+                heapq.heappush(heap, (current, switch_id))
+            else:
+                del self.deadlines[switch_id]
+                self.queued.discard(switch_id)
+                expired.append(switch_id)
+        return expired
+
+
+    def next_deadline(self):
+        '''Returns the earliest time a switch can expire (it may be earlier
+        than the real deadline, never later), or None if nothing is tracked.'''
+        if not self.heap:
+            return None
+        return self.heap[0][0]
+
+
+    def last_heard(self, switch_id):
+        '''Returns when switch_id was last heard from, or None.'''
+        deadline = self.deadlines.get(switch_id)
+        if deadline is None:
+            return None
+        return deadline - self.timeout
+
+
+    def __contains__(self, switch_id):
+        return switch_id in self.deadlines
+
+
+    def __len__(self):
+        return len(self.deadlines)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+"""Buffered log writer shared by the Controller and the Switch for ECE50863 Lab Project 1
+
+Log entries are handed to one background thread that keeps the log files
+open and writes everything that piled up for a file with a single
+writelines() call, so the receive loop never opens, writes or closes a file
+itself. One thread serves every log file of the process, which matters when
+many switches run in one process. The on-disk format is the same as before:
+every entry is preceded by a blank line pair.
+"""
+
+import atexit
+import queue
+import threading
+import time
+
+import metrics
+
+
+class LogWriter:
+    def __init__(self, flush_interval=0.5):
+        self.flush_interval = flush_interval # seconds between wakeups when idle
+        self.queue = queue.Queue()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+
+    def write(self, log_file, log):
+        '''Queues a log entry, a list of lines that already end in "\n".'''
+        self.queue.put((log_file, None, log))
+
+
+    def write_lazy(self, log_file, format_function, *args):
+        '''Queues a log entry that is only formatted on the writer thread by
+        calling format_function(*args), which must return a list of lines.
+        The arguments must not be modified after the call.'''
+        self.queue.put((log_file, format_function, args))
+
+
+    def flush(self):
+        '''Blocks until every queued entry is written and flushed to disk.'''
+        if not self.closed:
+            self.queue.join()
+
+
+    def close(self):
+        '''Writes everything that is still queued and stops the writer thread.'''
+        if self.closed:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.closed = True
+
+
+    def run(self):
+        files = {}
+        while True:
+            try:
+                entry = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            # Take everything else that is already waiting
+            batch = [entry]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # Every entry is marked done even when writing it failed, or 
+            # flush() would wait for it forever
+            stop = None in batch
+            try:
+                self.write_batch(files, batch)
+            except Exception as e:
+                metrics.count('log_errors')
+                print(f'Log writer: could not write {len(batch)} log entries: {e!r}')
+            finally:
+                for entry in batch:
+                    self.queue.task_done()
+            if stop:
+                for f in files.values():
+                    f.close()
+                return
+
+
+    def write_batch(self, files, batch):
+        '''Writes the entries of batch, keeping the log files open in files.
+        An entry that cannot be formatted or a file that cannot be written
+        is reported and skipped without losing the rest of the batch.'''
+        lines = {}
+        for entry in batch:
+            if entry is None:
+                continue
+            log_file, format_function, log = entry
+            if format_function is not None:
+                try:
+                    log = format_function(*log)
+                except Exception as e:
+                    metrics.count('log_errors')
+                    print(f'Log writer: could not format a log entry for {log_file}: {e!r}')
+                    continue
+            if log_file not in lines:
+                lines[log_file] = []
+            lines[log_file].append("\n\n")
+            lines[log_file].extend(log)
+
+        # Write to log
+        started = time.perf_counter()
+        for log_file, log in lines.items():
+            try:
+                if log_file not in files:
+                    files[log_file] = open(log_file, 'a+')
+                files[log_file].writelines(log)
+                files[log_file].flush()
+            except (OSError, TypeError) as e:
+                metrics.count('log_errors')
+                print(f'Log writer: could not write to {log_file}: {e!r}')
+        metrics.observe('log_write', time.perf_counter() - started)
+        metrics.count('log_entries', len(batch))
+
+
+class LogFile:
+    '''The log writer bound to one log file'''
+    def __init__(self, log_writer, log_file):
+        self.log_writer = log_writer
+        self.log_file = log_file
+
+    def write(self, log):
+        self.log_writer.write(self.log_file, log)
+
+    def write_lazy(self, format_function, *args):
+        self.log_writer.write_lazy(self.log_file, format_function, *args)
+
+    def flush(self):
+        self.log_writer.flush()
+
+
+log_writer = None
+log_writer_lock = threading.Lock()
+
+
+def get_log_writer(log_file):
+    '''Returns the writer for log_file, starting the writer thread the first
+    time.'''
+    global log_writer
+    if log_writer is None:
+        with log_writer_lock:
+            if log_writer is None:
+                log_writer = LogWriter()
+    return LogFile(log_writer, log_file)
+
+
+def flush_logs():
+    '''Flushes every log file, used before exiting.'''
+    if log_writer is not None:
+        log_writer.flush()
+
+
+def close_logs():
+    if log_writer is not None:
+        log_writer.close()
+
+atexit.register(close_logs)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+"""Counters and latency histograms for the Controller and the Switch in ECE50863 Lab Project 1
+
+Usage: python metrics.py <stats port> [hostname]
+
+The hot paths call count() and observe(), which only update a dictionary
+entry and a histogram bucket in this process. There is no lock: an update
+racing with another thread on the same name can be lost, which is fine for
+statistics. gauge() registers a function that is only called when a
+snapshot is taken.
+
+serve(port) answers any datagram sent to 127.0.0.1:<port> with the JSON
+snapshot (controller.py and switch.py -m <port>), and running this file
+queries such a port.
+
+verbose gates the prints made for every message, which otherwise cost more
+CPU than handling the message (-v on the command line).
+"""
+
+import bisect
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+# Upper bounds of the histogram buckets in seconds, 1 us to about 16 s
+BUCKETS = [1e-6 * 2 ** i for i in range(25)]
+
+verbose = False # print every message that is sent or received
+started_at = time.time()
+counters = {} # {name: count}
+histograms = {} # {name: Histogram}
+gauges = {} # {name: function returning the current value}
+
+
+class Histogram:
+    '''Latency histogram with power of two buckets'''
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+    def percentile(self, fraction):
+        '''Returns the upper bound of the bucket holding the given fraction of
+        the observations, never more than the largest observation.'''
+        target = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count > 0:
+                if i < len(BUCKETS):
+                    return min(BUCKETS[i], self.max)
+                break
+        return self.max
+
+
+    def snapshot(self):
+        if self.count == 0:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1000,
+            'p50_ms': self.percentile(0.5) * 1000,
+            'p90_ms': self.percentile(0.9) * 1000,
+            'p99_ms': self.percentile(0.99) * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+
+def count(name, value=1):
+    '''Adds value to the counter name'''
+    counters[name] = counters.get(name, 0) + value
+
+
+def observe(name, seconds):
+    '''Records a duration in the histogram name'''
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = Histogram()
+    histogram.observe(seconds)
+
+
+def gauge(name, function):
+    '''Registers function() as the current value of name'''
+    gauges[name] = function
+
+
+def snapshot():
+    '''Returns every counter, histogram and gauge as a dictionary'''
+    values = {}
+    for name, function in list(gauges.items()):
+        try:
+            values[name] = function()
+        except Exception as e:
+            values[name] = f'error: {e}'
+    return {
+        'pid': os.getpid(),
+        'uptime_s': time.time() - started_at,
+        'counters': dict(sorted(counters.items())),
+        'histograms': {name: histogram.snapshot() for name, histogram in sorted(histograms.items())},
+        'gauges': values,
+    }
+
+
+def serve(port):
+    '''Answers every datagram sent to 127.0.0.1:port with the JSON
+    snapshot, from a background thread.'''
+    stats_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    stats_socket.bind(('127.0.0.1', port))
+
+    def answer():
+        while True:
+            request, addr = stats_socket.recvfrom(64)
+            stats_socket.sendto(json.dumps(snapshot()).encode(), addr)
+
+    threading.Thread(target=answer, daemon=True).start()
+    print(f'Serving metrics on 127.0.0.1:{port}')
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python metrics.py <stats port> [hostname]\n")
+        sys.exit(1)
+    port = int(sys.argv[1])
+    hostname = sys.argv[2] if len(sys.argv) > 2 else '127.0.0.1'
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(2)
+    client.sendto(b'stats', (hostname, port))
+    data, addr = client.recvfrom(65535)
+    print(json.dumps(json.loads(data), indent=1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""Shortest paths computed by a pool of worker processes for ECE50863 Lab Project 1
+
+Used by the Controller with the "process" routing backend. The sources are
+split into chunks and every chunk runs routing.dijkstra() in a worker
+process, so a full table computation for a large topology uses every core.
+
+The topology is not pickled into every task. It is written once per
+computation into a shared memory block in CSR form (int32 values):
+[num_nodes, num_links, offsets (num_nodes + 1), neighbors (num_links),
+costs (num_links), live flags (num_nodes)], where the links of switch s are
+neighbors[offsets[s]:offsets[s + 1]]. A task only carries the block name
+and its sources, and each worker rebuilds the graph once per block.
+"""
+
+import array
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from routing import INFINITY, dijkstra
+
+CHUNKS_PER_WORKER = 4 # more chunks than workers evens out uneven sources
+MIN_PARALLEL_SOURCES = 64 # fewer sources than this are computed in process
+
+
+def pack_topology(graph, live_switches):
+    '''Returns graph and live_switches as an int32 array in the CSR layout
+    described above.'''
+    num_nodes = len(graph)
+    offsets = [0]
+    neighbors = []
+    costs = []
+    for links in graph:
+        for neighbor_id, cost in links:
+            neighbors.append(neighbor_id)
+            costs.append(cost)
+        offsets.append(len(neighbors))
+    live = [0] * num_nodes
+    for switch_id in live_switches:
+        if 0 <= switch_id < num_nodes:
+            live[switch_id] = 1
+    return array.array('i', [num_nodes, len(neighbors)] + offsets + neighbors + costs + live)
+
+
+def unpack_topology(buf):
+    '''Rebuilds (graph, live_switches) from a buffer written by
+    pack_topology().'''
+    view = memoryview(buf).cast('i')
+    try:
+        num_nodes, num_links = view[0], view[1]
+        values = view[:2 + num_nodes + 1 + 2 * num_links + num_nodes].tolist()
+    finally:
+        view.release()
+    offsets = values[2:num_nodes + 3]
+    start = num_nodes + 3
+    neighbors = values[start:start + num_links]
+    costs = values[start + num_links:start + 2 * num_links]
+    live = values[start + 2 * num_links:]
+
+    graph = []
+    for switch_id in range(num_nodes):
+        begin, end = offsets[switch_id], offsets[switch_id + 1]
+        graph.append(list(zip(neighbors[begin:end], costs[begin:end])))
+    live_switches = {switch_id for switch_id in range(num_nodes) if live[switch_id]}
+    return graph, live_switches
+
+
+topology_cache = {} # {shared memory name: (graph, live_switches)}, in a worker process
+
+
+def load_topology(name):
+    '''Returns the topology in the shared memory block name, reading it only
+    for the first task of a computation. Only the latest block is kept.'''
+    topology = topology_cache.get(name)
+    if topology is None:
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            topology = unpack_topology(shm.buf)
+        finally:
+            shm.close()
+        topology_cache.clear()
+        topology_cache[name] = topology
+    return topology
+
+
+def dijkstra_sources(name, sources):
+    '''Worker task: runs dijkstra() for every source over the topology in
+    the shared memory block name. Returns a list of
+    (source, distances, next_hop), the rows as int32 arrays so that they are
+    cheap to send back.'''
+    graph, live_switches = load_topology(name)
+    rows = []
+    for source in sources:
+        distances, next_hop = dijkstra(graph, live_switches, source)
+        rows.append((source, array.array('i', distances), array.array('i', next_hop)))
+    return rows
+
+
+class ParallelRouting:
+    '''A pool of worker processes that computes shortest paths for many
+    sources at once'''
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        # Spawned workers do not inherit the controller's threads and locks
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+    def shortest_paths(self, graph, live_switches, sources):
+        '''Returns {source: (distances, next_hop)} for the given sources, the
+        same rows dijkstra() returns.'''
+        sources = sorted(sources)
+        if len(sources) < MIN_PARALLEL_SOURCES:
+            return {source: dijkstra(graph, live_switches, source) for source in sources}
+
+        values = pack_topology(graph, live_switches)
+        size = len(values) * values.itemsize
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            shm.buf[:size] = values.tobytes()
+            chunk_size = -(-len(sources) // (self.workers * CHUNKS_PER_WORKER))
+            chunks = [sources[i:i + chunk_size] for i in range(0, len(sources), chunk_size)]
+            rows = {}
+            for chunk_rows in self.executor.map(dijkstra_sources, [shm.name] * len(chunks), chunks):
+                for source, distances, next_hop in chunk_rows:
+                    rows[source] = (distances.tolist(), next_hop.tolist())
+            return rows
+        finally:
+            shm.close()
+            shm.unlink()
+
+
+    def all_pairs_shortest_paths(self, graph, live_switches):
+        '''Same result as routing.all_pairs_shortest_paths(). Only the live
+        sources are sent to the workers, dead ones get INFINITY and -1.'''
+        num_nodes = len(graph)
+        rows = self.shortest_paths(graph, live_switches, [node for node in live_switches if 0 <= node < num_nodes])
+        distances = []
+        next_hops = []
+        for node in range(num_nodes):
+            if node in rows:
+                node_distances, node_next_hop = rows[node]
+            else:
+                node_distances, node_next_hop = [INFINITY] * num_nodes, [-1] * num_nodes
+            distances.append(node_distances)
+            next_hops.append(node_next_hop)
+        return distances, next_hops
+
+
+    def shutdown(self):
+        self.executor.shutdown()
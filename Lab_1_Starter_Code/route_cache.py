@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""Cache of computed routes keyed by topology state for ECE50863 Lab Project 1
+
+A switch that keeps dying and registering again takes the controller back
+and forth between the same few topology states. The distance and next hop
+matrices only depend on the links (their costs and the failed ones) and on
+the live switches, so the Controller keeps the matrices of the last few
+states in a RouteCache and reuses them when a state comes back instead of
+running the shortest path computation again.
+
+The key is a hash of the state. The graph and link_failure part only
+changes when links change, so it is computed once per graph by
+graph_digest() and combined with the live switches by topology_key().
+
+The rows of the matrices are not copied: an entry holds the same row lists
+as the Controller, which replaces a row instead of changing it. An
+incremental recomputation only replaces the rows it recomputed, so
+consecutive entries share most of their rows and each row is counted once
+towards max_bytes. Storing and loading an entry costs O(N), not O(N^2).
+"""
+
+import array
+import hashlib
+import sys
+from collections import OrderedDict
+
+MAX_BYTES = 128 << 20 # default size limit of the rows held by a RouteCache
+
+
+def graph_digest(graph, link_failure):
+    '''Returns a hash of the link costs in graph and of the failed links'''
+    h = hashlib.blake2b(digest_size=16)
+    for links in graph:
+        h.update(array.array('i', [value for link in links for value in link]).tobytes())
+        h.update(b'|')
+    failures = []
+    for switch_id, failed_id in sorted(link_failure.items()):
+        failures.append(switch_id)
+        failures.append(-1 if failed_id is None else failed_id)
+    h.update(array.array('i', failures).tobytes())
+    return h.digest()
+
+
+def topology_key(digest, live_switches):
+    '''Returns the cache key for the graph with the given digest and the
+    set of live switches'''
+    h = hashlib.blake2b(digest, digest_size=16)
+    h.update(array.array('i', sorted(live_switches)).tobytes())
+    return h.digest()
+
+
+class RouteCache:
+    '''Least recently used cache of {key: (distances, next_hops)}, bounded 
+    both by the number of entries and by the size of the rows they hold.
+    Rows must not be changed after they were put in the cache.'''
+    def __init__(self, capacity=16, max_bytes=MAX_BYTES):
+        self.capacity = capacity # 0 disables the cache
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.rows = {} # {id(row): [row, number of entries holding it, bytes]}
+        self.size = 0 # bytes of the distinct rows held
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def get(self, key):
+        '''Returns the cached (distances, next_hops) as new lists of the
+        cached rows, or None.'''
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        distances, next_hops = entry
+        return list(distances), list(next_hops)
+
+
+    def put(self, key, distances, next_hops):
+        '''Stores the matrices, evicting the least recently used entries 
+        while the cache holds more than capacity entries or max_bytes. An 
+        entry larger than max_bytes on its own is not stored.'''
+        if self.capacity <= 0:
+            return
+        old = self.entries.pop(key, None)
+        entry = (tuple(distances), tuple(next_hops))
+        self.hold(entry)
+        if old is not None:
+            self.release(old)
+        self.entries[key] = entry
+        while self.entries and (len(self.entries) > self.capacity or self.size > self.max_bytes):
+            self.release(self.entries.popitem(last=False)[1])
+            self.evictions += 1
+
+
+    def hold(self, entry):
+        for matrix in entry:
+            for row in matrix:
+                held = self.rows.get(id(row))
+                if held is None:
+                    size = sys.getsizeof(row)
+                    self.rows[id(row)] = [row, 1, size]
+                    self.size += size
+                else:
+                    held[1] += 1
+
+
+    def release(self, entry):
+        for matrix in entry:
+            for row in matrix:
+                held = self.rows[id(row)]
+                held[1] -= 1
+                if held[1] == 0:
+                    del self.rows[id(row)]
+                    self.size -= held[2]
+
+
+    def stats(self):
+        return f'{len(self.entries)}/{self.capacity} entries, {self.size / (1 << 20):.1f} MB, {self.hits} hits, {self.misses} misses, {self.evictions} evictions'
+
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+"""Shortest path routines used by the Controller for ECE50863 Lab Project 1
+
+The graph passed to these functions is the adjacency list built by
+Controller.create_graph(): graph[switch_id] is a list of (neighbor_id, cost)
+tuples for the links that actually exist.
+"""
+
+import heapq
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 9999 means infinite distance so that that switch can't be reached
+INFINITY = 9999
+
+
+def dijkstra(graph, live_switches, start_node):
+    '''Runs Dijkstra from start_node over the live switches of graph and
+    returns (distances, next_hop), each a list indexed by switch id.
+    distances[n] is the shortest distance to n and next_hop[n] is the first
+    switch on the way from start_node to n (start_node itself for n ==
+    start_node). Switches that are dead or can't be reached get INFINITY
+    and -1. When several shortest paths exist the smallest first hop is 
+    picked, which relies on link costs being positive.
+
+    Only the real links in graph[current_node] are relaxed and stale heap
+    entries are skipped on pop (lazy deletion), so one run is O(E log V).
+    The first hop is carried forward from the predecessor instead of 
+    copying whole paths, so no per-node lists are allocated.'''
+    num_nodes = len(graph)
+
+    distances = [INFINITY] * num_nodes
+    next_hop = [-1] * num_nodes
+
+    if start_node not in live_switches:
+        return distances, next_hop
+
+    next_hop[start_node] = start_node
+    distances[start_node] = 0
+    priority_queue = [(0, start_node)]
+
+    while priority_queue:
+        current_distance, current_node = heapq.heappop(priority_queue)
+
+        # Skip entries that were superseded by a shorter distance
+        if current_distance > distances[current_node]:
+            continue
+
+        # Direct neighbors of the source are their own first hop
+        if current_node == start_node:
+            first_hop = None
+        else:
+            first_hop = next_hop[current_node]
+
+        for neighbor, weight in graph[current_node]:
+            # A cost of INFINITY is not a link, and dead switches do not forward
+            if weight >= INFINITY or neighbor not in live_switches:
+                continue
+
+            if first_hop is None:
+                candidate_hop = neighbor
+            else:
+                candidate_hop = first_hop
+
+            new_distance = current_distance + weight
+            if new_distance < distances[neighbor]:
+                distances[neighbor] = new_distance
+                next_hop[neighbor] = candidate_hop
+                heapq.heappush(priority_queue, (new_distance, neighbor))
+            elif new_distance == distances[neighbor] and candidate_hop < next_hop[neighbor]:
+                # Equal cost path, keep the smallest first hop
+                next_hop[neighbor] = candidate_hop
+
+    return distances, next_hop
+
+
+def all_pairs_shortest_paths(graph, live_switches):
+    '''Computes the distance and next hop matrices for every pair of 
+    switches in one call. Returns (distances, next_hops) where 
+    distances[s][d] and next_hops[s][d] are the shortest distance and the 
+    first hop from switch s to switch d. Rows for dead switches are all 
+    INFINITY and -1.'''
+    num_nodes = len(graph)
+    distances = []
+    next_hops = []
+
+    for node in range(num_nodes):
+        node_distances, node_next_hop = dijkstra(graph, live_switches, node)
+        distances.append(node_distances)
+        next_hops.append(node_next_hop)
+
+    return distances, next_hops
+
+
+def all_pairs_shortest_paths_numpy(graph, live_switches):
+    '''Same result as all_pairs_shortest_paths() but holds the link costs in 
+    a NumPy matrix and runs a vectorized min-plus (Floyd-Warshall) 
+    relaxation. Dead switches are masked out of the cost matrix, failed 
+    links are already missing from graph. This is O(V^3) array work, so it 
+    pays off on medium sized, dense topologies.'''
+    if np is None:
+        raise ImportError('The numpy routing backend requires numpy to be installed')
+
+    num_nodes = len(graph)
+    live = np.zeros(num_nodes, dtype=bool)
+    live[[node for node in live_switches if 0 <= node < num_nodes]] = True
+
+    # Link costs, np.inf where there is no link
+    cost = np.full((num_nodes, num_nodes), np.inf)
+    for self_id in range(num_nodes):
+        for neighbor_id, weight in graph[self_id]:
+            if weight < INFINITY and weight < cost[self_id, neighbor_id]:
+                cost[self_id, neighbor_id] = weight
+    cost[~live, :] = np.inf
+    cost[:, ~live] = np.inf
+
+    live_ids = np.flatnonzero(live)
+    distances = cost.copy()
+    distances[live_ids, live_ids] = 0
+    for k in live_ids:
+        np.minimum(distances, distances[:, k, None] + distances[None, k, :], out=distances)
+
+    # The next hop from s to d is the smallest neighbor n of s that lies on 
+    # a shortest path, i.e. cost[s][n] + distances[n][d] == distances[s][d]
+    next_hops = np.full((num_nodes, num_nodes), -1, dtype=np.int64)
+    for switch_id in live_ids:
+        neighbors = np.flatnonzero(np.isfinite(cost[switch_id]))
+        if len(neighbors):
+            tight = (cost[switch_id, neighbors, None] + distances[neighbors, :]) == distances[switch_id]
+            reachable = tight.any(axis=0) & np.isfinite(distances[switch_id])
+            next_hops[switch_id, reachable] = neighbors[tight.argmax(axis=0)[reachable]]
+        next_hops[switch_id, switch_id] = switch_id
+
+    distances = np.where(np.isfinite(distances), distances, INFINITY).astype(np.int64)
+    return distances.tolist(), next_hops.tolist()
+
+
+def routing_table_rows(distances, next_hops, live_switches):
+    '''Turns the distance and next hop matrices into the routing table 
+    format used by the logging functions: a list of 
+    [<Switch ID>, <Dest ID>, <Next Hop>, <Shortest distance>] for every
+    live switch and every destination.'''
+    routing_table = []
+    for switch_id in range(len(distances)):
+        if switch_id not in live_switches:
+            continue
+        switch_distances = distances[switch_id]
+        switch_next_hop = next_hops[switch_id]
+        for dest_id in range(len(switch_distances)):
+            routing_table.append([switch_id, dest_id, switch_next_hop[dest_id], switch_distances[dest_id]])
+    return routing_table
+
+
+def sources_affected_by_switch(graph, distances, live_switches, switch_id):
+    '''Returns the live sources whose shortest paths go through switch_id,
+    i.e. the sources that have to be recomputed when switch_id dies. A 
+    source is affected if, for some neighbor n of switch_id, the shortest 
+    path to n can be made through switch_id 
+    (distances[s][switch_id] + cost == distances[s][n]). Every other source 
+    keeps its routes, only the entry for switch_id itself becomes 
+    unreachable.'''
+    affected = set()
+    for source in live_switches:
+        if source == switch_id:
+            continue
+        source_distances = distances[source]
+        distance = source_distances[switch_id]
+        if distance >= INFINITY:
+            continue
+        for neighbor, weight in graph[switch_id]:
+            if neighbor != source and distance + weight == source_distances[neighbor]:
+                affected.add(source)
+                break
+    return affected
+
+
+def sources_affected_by_link(distances, live_switches, switch_id_1, switch_id_2, old_cost, new_cost):
+    '''Returns the live sources whose routes can change when the cost of the 
+    link between switch_id_1 and switch_id_2 goes from old_cost to new_cost 
+    (INFINITY meaning no link). If the link gets more expensive only the 
+    sources that used it on a shortest path are affected, if it gets 
+    cheaper only the sources that can reach one end at least as cheaply 
+    through the other end are affected.'''
+    affected = set()
+    if new_cost == old_cost:
+        return affected
+
+    for source in live_switches:
+        distance_1 = distances[source][switch_id_1]
+        distance_2 = distances[source][switch_id_2]
+        if new_cost > old_cost:
+            # Link got worse, was it on a shortest path?
+            if old_cost >= INFINITY:
+                continue
+            if distance_1 + old_cost == distance_2 or distance_2 + old_cost == distance_1:
+                affected.add(source)
+        else:
+            # Link got better, does it give an equal or shorter path?
+            if distance_1 + new_cost <= distance_2 or distance_2 + new_cost <= distance_1:
+                affected.add(source)
+    return affected
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""Snapshots of the controller state for warm restarts in ECE50863 Lab Project 1
+
+With -s <snapshot file> the Controller writes the state it learned from the
+registrations (switch addresses, live switches and failed links) to the file
+every K seconds when it changed. A controller started again with the same
+file and the same topology (in either config file format) loads it and
+sends the routing tables right away instead of waiting for every switch to
+register again.
+
+The snapshot is a small JSON file:
+{"version": 1, "config_digest": ..., "saved_at": ..., "routing_version": ...,
+ "switch_addresses": [[switch_id, host, port], ...], "live_switches": [...],
+ "link_failure": [[switch_id, failed_id or null], ...]}
+It is written to a temporary file that then replaces the old one, so a crash
+while saving leaves the previous snapshot intact. The routes are not saved,
+they are computed again from the config file in well under a second.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+SNAPSHOT_VERSION = 1
+
+
+def topology_digest(num_switches, links):
+    '''Returns a hash of the topology read by topology_file.read_links(), a
+    snapshot only applies to the topology it was taken for'''
+    h = hashlib.blake2b(digest_size=16)
+    h.update(num_switches.to_bytes(4, 'little'))
+    h.update(links.tobytes())
+    return h.hexdigest()
+
+
+def save_snapshot(snapshot_file, state):
+    '''Writes state to snapshot_file, replacing the file in one step'''
+    state = dict(state, version=SNAPSHOT_VERSION, saved_at=time.time())
+    with open(snapshot_file + '.tmp', 'w') as f:
+        json.dump(state, f, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(snapshot_file + '.tmp', snapshot_file)
+
+
+def load_snapshot(snapshot_file, digest):
+    '''Returns the state saved in snapshot_file, or None when there is no
+    usable snapshot for the topology with the given topology_digest()'''
+    try:
+        with open(snapshot_file, 'r') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f'Ignoring snapshot {snapshot_file}: {e}')
+        return None
+    if state.get('version') != SNAPSHOT_VERSION:
+        print(f'Ignoring snapshot {snapshot_file}: version {state.get("version")}')
+        return None
+    if state.get('config_digest') != digest:
+        print(f'Ignoring snapshot {snapshot_file}: it was taken for another topology')
+        return None
+    return state
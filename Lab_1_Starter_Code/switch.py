@@ -9,15 +9,21 @@ Last Modified Date: December 9th, 2021
 import sys
 from datetime import date, datetime
 import socket
-import pickle
 import signal
 import time
-import threading
+import asyncio
+
+import metrics
+import transport
+from codec import decode, encode
+from liveness import LivenessTracker
+from log_writer import flush_logs, get_log_writer
 
 def handler(signum, frame):
     # res = input("Ctrl-c was pressed. Do you really want to exit? y/n ")
     # if res == 'y':
     print("Ctrl-c was pressed. Quiting...")
+    flush_logs()
     exit(1)
 signal.signal(signal.SIGINT, handler)
 
@@ -31,22 +37,22 @@ LOG_FILE = "switch#.log" # The log file for switches are switch#.log, where # is
 # Timestamp
 # Register Request Sent
 
-def register_request_sent():
+def register_request_sent(log_file=None):
     log = []
     log.append(str(datetime.time(datetime.now())) + "\n")
     log.append(f"Register Request Sent\n")
-    write_to_log(log)
+    write_to_log(log, log_file)
 
 # "Register Response" Format is below:
 #
 # Timestamp
 # Register Response Received
 
-def register_response_received():
+def register_response_received(log_file=None):
     log = []
     log.append(str(datetime.time(datetime.now())) + "\n")
     log.append(f"Register Response received\n")
-    write_to_log(log) 
+    write_to_log(log, log_file) 
 
 # For the parameter "routing_table", it should be a list of lists in the form of [[...], [...], ...]. 
 # Within each list in the outermost list, the first element is <Switch ID>. The second is <Dest ID>, and the third is <Next Hop>.
@@ -62,58 +68,76 @@ def register_response_received():
 # You should also include all of the Self routes in your routing_table argument -- e.g.,  Switch (ID = 4) should include the following entry: 		
 # 4,4:4
 
-def routing_table_update(routing_table):
+def routing_table_update(routing_table, log_file=None):
+    # Formatting the rows is left to the log writer thread
+    timestamp = str(datetime.time(datetime.now()))
+    get_log_writer(log_file or LOG_FILE).write_lazy(format_routing_table_update, timestamp, routing_table)
+
+def format_routing_table_update(timestamp, routing_table):
     log = []
-    log.append(str(datetime.time(datetime.now())) + "\n")
+    log.append(timestamp + "\n")
     log.append("Routing Update\n")
     for row in routing_table:
         log.append(f"{row[0]},{row[1]}:{row[2]}\n")
     log.append("Routing Complete\n")
-    write_to_log(log)
+    return log
 
 # "Unresponsive/Dead Neighbor Detected" Format is below:
 #
 # Timestamp
 # Neighbor Dead <Neighbor ID>
 
-def neighbor_dead(switch_id):
+def neighbor_dead(switch_id, log_file=None):
     log = []
     log.append(str(datetime.time(datetime.now())) + "\n")
     log.append(f"Neighbor Dead {switch_id}\n")
-    write_to_log(log) 
+    write_to_log(log, log_file) 
 
 # "Unresponsive/Dead Neighbor comes back online" Format is below:
 #
 # Timestamp
 # Neighbor Alive <Neighbor ID>
 
-def neighbor_alive(switch_id):
+def neighbor_alive(switch_id, log_file=None):
     log = []
     log.append(str(datetime.time(datetime.now())) + "\n")
     log.append(f"Neighbor Alive {switch_id}\n")
-    write_to_log(log) 
+    write_to_log(log, log_file) 
 
-def write_to_log(log):
-    with open(LOG_FILE, 'a+') as log_file:
-        log_file.write("\n\n")
-        # Write to log
-        log_file.writelines(log)
+def write_to_log(log, log_file=None):
+    # Queued and written by a background thread, see log_writer.py
+    # log_file defaults to LOG_FILE, switches sharing a process pass their own
+    get_log_writer(log_file or LOG_FILE).write(log)
         
         
 class Switch:
     def __init__(self, switch_id, controller_addr,failed_neighbor):
         self.switch_id = int(switch_id)
+        self.log_file = 'switch' + str(self.switch_id) + ".log"
         self.controller_addr = controller_addr
         self.live_neighbors = set()
         self.neighbor_state = {}
-        self.neighbor_statuses = {}
         self.connected_switches = {}
-        self.routing_table = {}
+        self.routing_table = {} # {dest_id: next_hop}
+        self.routing_version = 0
         self.failed_neighbor = failed_neighbor
         self.link_failure = {}
+        self.topology_sequence = 0 # sequence number of the last Topology_Update sent
+        self.acked_sequence = 0 # last sequence acknowledged by the controller, 0 for none
+        self.acked_state = {} # neighbor_state as the controller last acknowledged it
+        self.sent_states = {} # {sequence: neighbor_state sent}, until acknowledged
+        self.updates_since_refresh = 0
+        self.TOPOLOGY_REFRESH = 10 # send the full neighbor_state every TOPOLOGY_REFRESH updates
         self.K = 2
         self.TIMEOUT = 3 * self.K
+        self.neighbor_liveness = LivenessTracker(self.TIMEOUT) # Keep_Alive deadline of each live neighbor
         self.switch_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sender = self.switch_socket # replaced by the event loop transport in start()
+        self.reassembler = transport.Reassembler()
+        self.registered = False
+        self.started = False
+        self.loop = None
+        self.timers = {}
         
         # self.live_neighbors.discard(self.failed_neighbor)
     
@@ -121,144 +145,295 @@ class Switch:
     def send_register_request(self):
         # Send Register REQUESTS
         msg = ['Register_Request',self.switch_id,self.failed_neighbor]
-        data = pickle.dumps(msg)
-        self.switch_socket.sendto(data, self.controller_addr)
-        register_request_sent()
+        data = encode(msg)
+        transport.send(self.sender, data, self.controller_addr)
+        register_request_sent(self.log_file)
         print('Switch sent register request to the controller')
     
     
+    def send_routing_resync(self):
+        # Ask the controller for the full routing table
+        msg = ['Routing_Resync',self.switch_id]
+        data = encode(msg)
+        transport.send(self.sender, data, self.controller_addr)
+    
+    
+    def routing_table_rows(self):
+        '''Returns the routing table as a list of [<Switch ID>, <Dest ID>, <Next Hop>] 
+        sorted by destination, the format used by routing_table_update()'''
+        return [[self.switch_id, dest_id, hop] for dest_id, hop in sorted(self.routing_table.items())]
+    
+    
     def send_keep_alive(self):
         '''This function is used to send a Keep_Alive message to each of the 
-        neighboring switches it thinks is alive every K seconds.'''
+        neighboring switches it thinks is alive. It is called every K seconds.'''
         msg = ['Keep_Alive',self.switch_id]
-        data = pickle.dumps(msg)
-        while True:
-            time.sleep(self.K)
-            self.neighbor_statuses[self.switch_id] = time.time()
-            for neighbor in self.live_neighbors.copy():
-                # if switch is not the same id as itself and neighbor id is not a link failure
-                if (self.switch_id != neighbor) or (self.switch_id == self.link_failure[neighbor]):
-                    self.switch_socket.sendto(data, self.connected_switches[neighbor])
+        data = encode(msg)
+        for neighbor in self.live_neighbors.copy():
+            # if switch is not the same id as itself and neighbor id is not a link failure
+            if (self.switch_id != neighbor) or (self.switch_id == self.link_failure[neighbor]):
+                transport.send(self.sender, data, self.connected_switches[neighbor])
+                if metrics.verbose:
                     print(f'Switch {self.switch_id} sending Keep_Alive to switch {neighbor}')
 
 
     def send_topology_update(self):
         '''This function is used to send a Topology_Update message to the 
-        controller every K seconds. The Topology Update message includes a set 
-        of live neighbors.'''
-        while True:
-            time.sleep(self.K)
-            msg = ['Topology_Update',self.switch_id,self.neighbor_state,self.neighbor_statuses]
-            data = pickle.dumps(msg)
-            self.switch_socket.sendto(data,self.controller_addr)
-            print(f'Switch {self.switch_id} sending Topology_Update to controller.')
-            # print(f'Neighbor Statuses = {self.neighbor_statuses}')
+        controller. It is called every K seconds and whenever a neighbor 
+        changes state. Usually only the neighbors whose state changed since 
+        the last update the controller acknowledged are sent, in a 
+        Topology_Update_Delta. The full neighbor_state is sent until the 
+        controller acknowledged one and then every TOPOLOGY_REFRESH updates.'''
+        self.topology_sequence += 1
+        changes = {}
+        for neighbor_id, state in self.neighbor_state.items():
+            if self.acked_state.get(neighbor_id) != state:
+                changes[neighbor_id] = state
+        if self.acked_sequence == 0 or self.updates_since_refresh >= self.TOPOLOGY_REFRESH:
+            msg = ['Topology_Update',self.switch_id,self.topology_sequence,self.neighbor_state]
+            self.updates_since_refresh = 0
+        else:
+            msg = ['Topology_Update_Delta',self.switch_id,self.topology_sequence,self.acked_sequence,changes]
+            self.updates_since_refresh += 1
+        if changes or msg[0] == 'Topology_Update':
+            # The controller only acknowledges updates that change something
+            self.sent_states[self.topology_sequence] = dict(self.neighbor_state)
+            while len(self.sent_states) > self.TOPOLOGY_REFRESH:
+                del self.sent_states[next(iter(self.sent_states))]
+        data = encode(msg)
+        transport.send(self.sender, data, self.controller_addr)
+        if metrics.verbose:
+            print(f'Switch {self.switch_id} sending {msg[0]} to controller.')
                 
             
     def handle_timeout(self):
-        while True:
-            time.sleep(self.TIMEOUT)
-            # Simulate checking for timeout
-            boolean = False
-            for neighbor in self.live_neighbors.copy():
-                if (neighbor == self.failed_neighbor) or (self.switch_id == self.link_failure[neighbor]):
-                    print('Timeout for failed neighbor... skipping')
-                elif self.neighbor_statuses.get(neighbor) < time.time() - self.TIMEOUT:
-                    neighbor_dead(neighbor)
-                    print(f"Timeout for Switch {neighbor} detected by Switch {self.switch_id}")
-                    # Mark the neighbor as down, update topology, and notify the controller
-                    self.live_neighbors.discard(neighbor)
-                    self.neighbor_state[neighbor] = False
-                    boolean = True
-            if boolean == True:
-                self.send_topology_update()
-                boolean == False
+        '''Marks the neighbors that have not sent a Keep_Alive for TIMEOUT 
+        seconds as dead and notifies the controller. Only the neighbors whose 
+        deadline passed are looked at.'''
+        boolean = False
+        for neighbor in self.neighbor_liveness.expired():
+            if neighbor not in self.live_neighbors:
+                continue
+            if (neighbor == self.failed_neighbor) or (self.switch_id == self.link_failure.get(neighbor)):
+                print('Timeout for failed neighbor... skipping')
+                continue
+            neighbor_dead(neighbor, self.log_file)
+            print(f"Timeout for Switch {neighbor} detected by Switch {self.switch_id}")
+            # Mark the neighbor as down, update topology, and notify the controller
+            self.live_neighbors.discard(neighbor)
+            self.neighbor_state[neighbor] = False
+            boolean = True
+        if boolean == True:
+            self.send_topology_update()
     
     
     def handle_recv_message(self,recvd_data, recvd_addr):
         # Check if the recvd addr is from the controller
-        recvd_msg =  pickle.loads(recvd_data)
+        started = time.perf_counter()
+        try:
+            recvd_msg = decode(recvd_data)
+        except ValueError as e:
+            metrics.count('dropped.decode')
+            print(f'Dropping message from {recvd_addr}: {e}')
+            return
+        metrics.observe('decode', time.perf_counter() - started)
         
         request_type = recvd_msg[0]
         msg = recvd_msg[1]
-        print(recvd_msg)
+        metrics.count('received.' + request_type)
+        if metrics.verbose:
+            print(recvd_msg)
         
         if request_type == 'Register_Response':
             link_failure = recvd_msg[2]
             print('Received Register_Response')
-            register_response_received()
+            register_response_received(self.log_file)
             
             self.link_failure = link_failure
+            self.registered = True
 
-            for line in msg.split('\n')[1:]:
-                l = line.split()
-                if l:
-                    neighbor_id, addr, port = l
-                    neighbor_id = int(neighbor_id)
-                    port = int(port)
-                    if (self.switch_id != neighbor_id):
-                        # if the key (ie. node-link is broken do not set as live_neighbor)
-                        if (self.switch_id in self.link_failure) and (neighbor_id == self.link_failure[self.switch_id]):
-                            print(f'Link failure between {self.switch_id}-{neighbor_id}')
-                        
-                        elif (neighbor_id in self.link_failure) and (self.switch_id == self.link_failure[neighbor_id]):
-                            print(f'Link failure between {self.switch_id}-{neighbor_id}')
-                        
-                        else:
-                            self.connected_switches[neighbor_id] = (addr, port)
-                            self.live_neighbors.add(neighbor_id)
-                            self.neighbor_statuses[neighbor_id] = time.time()
-                            self.neighbor_state[neighbor_id] = True
+            for neighbor_id, addr, port in msg:
+                if (self.switch_id != neighbor_id):
+                    # if the key (ie. node-link is broken do not set as live_neighbor)
+                    if (self.switch_id in self.link_failure) and (neighbor_id == self.link_failure[self.switch_id]):
+                        print(f'Link failure between {self.switch_id}-{neighbor_id}')
+                    
+                    elif (neighbor_id in self.link_failure) and (self.switch_id == self.link_failure[neighbor_id]):
+                        print(f'Link failure between {self.switch_id}-{neighbor_id}')
+                    
+                    else:
+                        self.connected_switches[neighbor_id] = (addr, port)
+                        self.live_neighbors.add(neighbor_id)
+                        self.neighbor_liveness.touch(neighbor_id)
+                        self.neighbor_state[neighbor_id] = True
 
                 
         elif request_type == 'Routing_Update':
-            print('Received Routing_Update')
-            routing_table_update(msg)
-            self.routing_table = msg
+            if metrics.verbose:
+                print('Received Routing_Update')
+            self.routing_table = {}
+            for row in msg:
+                self.routing_table[row[1]] = row[2]
+            if len(recvd_msg) > 2:
+                self.routing_version = recvd_msg[2]
+            routing_table_update(self.routing_table_rows(), self.log_file)
             # print(f'Routing_Update = {self.routing_table}')
+        
+        elif request_type == 'Routing_Update_Delta':
+            # [Routing_Update_Delta, switch_id, version, base_version, rows, removed]
+            if metrics.verbose:
+                print('Received Routing_Update_Delta')
+            version = recvd_msg[2]
+            base_version = recvd_msg[3]
+            if base_version != self.routing_version:
+                # Missed an update, ask the controller for the whole table
+                print(f'Routing_Update_Delta for version {base_version} but have version {self.routing_version}, resyncing')
+                metrics.count('resyncs')
+                self.send_routing_resync()
+            else:
+                for row in recvd_msg[4]:
+                    self.routing_table[row[1]] = row[2]
+                for dest_id in recvd_msg[5]:
+                    self.routing_table.pop(dest_id, None)
+                self.routing_version = version
+                routing_table_update(self.routing_table_rows(), self.log_file)
+            
+        elif request_type == 'Topology_Ack':
+            # [Topology_Ack, sequence], later deltas are relative to that update
+            sequence = msg
+            if sequence == 0:
+                # The controller does not have our earlier updates, start over
+                print('Controller asked for the full neighbor state')
+                self.acked_sequence = 0
+                self.acked_state = {}
+                self.sent_states = {}
+                self.send_topology_update()
+            elif sequence > self.acked_sequence and sequence in self.sent_states:
+                self.acked_sequence = sequence
+                self.acked_state = self.sent_states[sequence]
+                for sent_sequence in list(self.sent_states):
+                    if sent_sequence <= sequence:
+                        del self.sent_states[sent_sequence]
             
         # if a switch receives a keep alive message from a switch it previously 
         # considered unreachable it updates the host/post info and sends a 
         # topology update to the controller
         elif (request_type == 'Keep_Alive'):
             neighbor_id = int(msg)
-            print(f'Received Keep_Alive from switch {neighbor_id}')
+            if metrics.verbose:
+                print(f'Received Keep_Alive from switch {neighbor_id}')
             # if the key (ie. node-link is broken do not set as live_neighbor)
             if (self.switch_id in self.link_failure) and (neighbor_id == self.link_failure[self.switch_id]):
-                print(f'Link failure between {self.switch_id}-{neighbor_id}')
+                if metrics.verbose:
+                    print(f'Link failure between {self.switch_id}-{neighbor_id}')
             
             elif (neighbor_id in self.link_failure) and (self.switch_id == self.link_failure[neighbor_id]):
-                print(f'Link failure between {self.switch_id}-{neighbor_id}')
+                if metrics.verbose:
+                    print(f'Link failure between {self.switch_id}-{neighbor_id}')
                 
             elif (neighbor_id not in self.live_neighbors.copy()):
                 # print(f'neighbor {neighbor_id} is alive again')
-                neighbor_alive(neighbor_id)
+                neighbor_alive(neighbor_id, self.log_file)
                 hostname, port = recvd_addr
                 port = int(port)
                 addr = (hostname,port)
                 self.connected_switches[neighbor_id] = recvd_addr
                 self.neighbor_state[neighbor_id] = True
                 self.live_neighbors.add(neighbor_id)
-                self.neighbor_statuses[neighbor_id] = time.time()
+                self.neighbor_liveness.touch(neighbor_id)
                 self.send_topology_update()
             else:
-                self.neighbor_statuses[neighbor_id] = time.time()
+                if self.connected_switches.get(neighbor_id) != recvd_addr:
+                    # The neighbor restarted on another port before we 
+                    # noticed it was gone, send our Keep_Alives there
+                    self.connected_switches[neighbor_id] = recvd_addr
+                self.neighbor_liveness.touch(neighbor_id)
                 
                 
-    def receive_messages(self):
-        while True:
-            recvd_data, addr = self.switch_socket.recvfrom(1024)
+    def datagram_received(self, recvd_data, addr):
+        '''Handles one received datagram once its message is complete'''
+        try:
+            recvd_data = self.reassembler.feed(recvd_data, addr)
+        except ValueError as e:
+            metrics.count('dropped.fragment')
+            print(f'Dropping fragment from {addr}: {e}')
+            return
+        if recvd_data is not None:
             self.handle_recv_message(recvd_data, addr)
-                
-                
+            if self.registered and not self.started:
+                self.start_timers()
+    
+    
+    def schedule(self, delay, callback):
+        '''Runs callback every delay seconds on the event loop'''
+        def tick():
+            callback()
+            self.timers[callback.__name__] = self.loop.call_later(delay, tick)
+        self.timers[callback.__name__] = self.loop.call_later(delay, tick)
+    
+    
+    def schedule_timeout_check(self):
+        '''Runs handle_timeout() as soon as the earliest neighbor deadline is 
+        due, so a dead neighbor is detected TIMEOUT seconds after its last 
+        Keep_Alive rather than up to 2 x TIMEOUT.'''
+        deadline = self.neighbor_liveness.next_deadline()
+        if deadline is None:
+            delay = self.K
+        else:
+            delay = max(0, deadline - time.time())
+        def tick():
+            self.handle_timeout()
+            self.schedule_timeout_check()
+        self.timers['handle_timeout'] = self.loop.call_later(delay, tick)
+    
+    
+    def start_timers(self):
+        # Keep Alive, Topology Update, and Timeout Handling
+        self.started = True
+        self.schedule(self.K, self.send_keep_alive)
+        self.schedule_timeout_check()
+        self.schedule(self.K, self.send_topology_update)
+    
+    
+    async def start(self):
+        '''Attaches the switch to the running event loop and registers with 
+        the controller. Receiving, Keep Alive, Topology Update and Timeout 
+        Handling all run as callbacks on this loop, so many switches can 
+        share one loop.'''
+        self.loop = asyncio.get_running_loop()
+        self.switch_socket.setblocking(False)
+        self.sender, protocol = await self.loop.create_datagram_endpoint(
+            lambda: SwitchProtocol(self), sock=self.switch_socket)
+        self.send_register_request()
+        print("\nWaiting for response from controller...")
+    
+    
+    def stop(self):
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers = {}
+        self.sender.close()
+    
+    
+    async def serve_forever(self):
+        await self.start()
+        await asyncio.Event().wait()
+    
+    
     def run(self):
-        # Start threads for Keep Alive, Topology Update, and Timeout Handling
-        threading.Thread(target=self.receive_messages, args=(), daemon=False).start()
-        
-        threading.Thread(target=self.send_keep_alive, daemon=False).start()
-        threading.Thread(target=self.handle_timeout, daemon=False).start()
-        threading.Thread(target=self.send_topology_update, daemon=False).start()
-            
+        asyncio.run(self.serve_forever())
+
+
+class SwitchProtocol(asyncio.DatagramProtocol):
+    '''Hands the datagrams received on a switch socket to the switch'''
+    def __init__(self, switch):
+        self.switch = switch
+    
+    def datagram_received(self, data, addr):
+        self.switch.datagram_received(data, addr)
+    
+    def error_received(self, exc):
+        print(f'Switch {self.switch.switch_id} socket error: {exc}')
 
 
 def main():
@@ -268,7 +443,7 @@ def main():
     #Check for number of arguments and exit if host/port not provided
     num_args = len(sys.argv)
     if num_args < 4:
-        print ("switch.py <Id_self> <Controller hostname> <Controller Port>\n")
+        print ("switch.py <Id_self> <Controller hostname> <Controller Port> [-f <Id_neighbor>] [-m <stats port>] [-v]\n")
         sys.exit(1)
 
     my_id = int(sys.argv[1])
@@ -289,15 +464,17 @@ def main():
         failed_neighbor_index = sys.argv.index("-f") + 1
         failed_neighbor = int(sys.argv[failed_neighbor_index])
     
-    switch = Switch(my_id,controller_addr,failed_neighbor)
-    switch.send_register_request()
-    print("\nWaiting for response from controller...")
-    recvd_data, controller_addr = switch.switch_socket.recvfrom(1024)
-    switch.handle_recv_message(recvd_data, controller_addr)
+    # -v prints every message, -m serves the metrics on a local UDP port
+    metrics.verbose = "-v" in sys.argv
     
-    print('---> Received response from controller')
+    switch = Switch(my_id,controller_addr,failed_neighbor)
     
-    print('Starting Threading')
+    if "-m" in sys.argv:
+        stats_port_index = sys.argv.index("-m") + 1
+        metrics.gauge('live_neighbors', lambda: len(switch.live_neighbors))
+        metrics.gauge('routing_version', lambda: switch.routing_version)
+        metrics.gauge('sent', transport.sent_snapshot)
+        metrics.serve(int(sys.argv[stats_port_index]))
     switch.run()
 
 
@@ -308,7 +485,4 @@ if __name__ == "__main__":
     # print(switch.__dict__)
     # switch = Switch(1,('USMCDWNCAD6MLXY',1024))
     
-    # switch.neighbor_statuses[1] = time.time()
-    # print(time.time())
-    
-    # print(switch.neighbor_statuses.get(1) < time.time() - switch.TIMEOUT)
\ No newline at end of file
+    # print(time.time())
\ No newline at end of file
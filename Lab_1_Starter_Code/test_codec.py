@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""Tests of the binary message codec in codec.py
+
+Run with: python -m pytest test_codec.py (or python -m unittest)
+"""
+
+import pickle
+import unittest
+
+from bench_codec import sample_messages
+from codec import decode, encode
+
+
+class TestRoundTrip(unittest.TestCase):
+    def assertRoundTrip(self, message):
+        self.assertEqual(decode(encode(message)), message)
+
+    def test_sample_messages(self):
+        for num_switches in (2, 6, 200, 300, 1000, 70000):
+            for message in sample_messages(num_switches):
+                with self.subTest(num_switches=num_switches, message_type=message[0]):
+                    self.assertRoundTrip(message)
+
+    def test_ids_of_every_width(self):
+        for ids in ([], [0], [255], [256], [65535], [65536], [-1, 5], [-1, 200], [-40000, 3], [2 ** 31 - 1]):
+            with self.subTest(ids=ids):
+                self.assertRoundTrip(['Routing_Update_Delta', 0, 5, 4, [[0, dest_id, dest_id] for dest_id in ids], ids])
+
+    def test_routing_rows(self):
+        self.assertRoundTrip(['Routing_Update', [], 0])
+        self.assertRoundTrip(['Routing_Update', [[3, 0, 1], [3, 1, 1], [3, 2, -1], [3, 3, 3]], 7])
+        # Destinations not in order and rows of several switches
+        self.assertRoundTrip(['Routing_Update', [[3, 1, 1], [3, 0, 1]], 7])
+        self.assertRoundTrip(['Routing_Update', [[3, 0, 1], [3, 2, 1]], 7])
+        self.assertRoundTrip(['Routing_Update', [[0, 0, 0], [0, 1, 1], [1, 0, 0], [1, 1, 1]], 7])
+
+    def test_register_response(self):
+        self.assertRoundTrip(['Register_Response', [], {}])
+        self.assertRoundTrip(['Register_Response', [], {0: None}])
+        self.assertRoundTrip(['Register_Response', [(1, 'localhost', 5001)], {0: 1, 1: None}])
+        self.assertRoundTrip(['Register_Response', [(1, 'a', 5001), (2, 'b', 5002), (3, 'a', 5003), (4, 'hôte', 65535)],
+                              {0: None, 1: 2, 2: 1, 3: None, 4: None}])
+
+    def test_neighbor_states(self):
+        for num_neighbors in range(0, 20):
+            states = {neighbor_id: neighbor_id % 3 == 0 for neighbor_id in range(num_neighbors)}
+            with self.subTest(num_neighbors=num_neighbors):
+                self.assertRoundTrip(['Topology_Update', 2, 9, states])
+                self.assertRoundTrip(['Topology_Update_Delta', 2, 9, 8, states])
+
+    def test_small_messages(self):
+        self.assertRoundTrip(['Register_Request', 4, None])
+        self.assertRoundTrip(['Register_Request', 4, 2])
+        self.assertRoundTrip(['Keep_Alive', 0])
+        self.assertRoundTrip(['Keep_Alive', 2 ** 31 - 1])
+        self.assertRoundTrip(['Topology_Ack', 0])
+        self.assertRoundTrip(['Routing_Resync', 3])
+
+    def test_smaller_than_pickle(self):
+        for message in sample_messages(1000):
+            if message[0] in ('Register_Response', 'Topology_Update', 'Routing_Update', 'Routing_Update_Delta'):
+                with self.subTest(message_type=message[0]):
+                    self.assertLess(len(encode(message)), len(pickle.dumps(message)))
+
+
+class TestMalformed(unittest.TestCase):
+    def test_truncated_messages(self):
+        for message in sample_messages(300):
+            data = encode(message)
+            for end in range(len(data)):
+                with self.subTest(message_type=message[0], end=end):
+                    with self.assertRaises(ValueError):
+                        decode(data[:end])
+
+    def test_wrong_version(self):
+        data = bytearray(encode(['Keep_Alive', 1]))
+        data[0] += 1
+        with self.assertRaises(ValueError):
+            decode(bytes(data))
+
+    def test_unknown_message_type(self):
+        data = bytearray(encode(['Routing_Resync', 1]))
+        data[1] = 200
+        with self.assertRaises(ValueError):
+            decode(bytes(data))
+
+    def test_unknown_array_type(self):
+        data = bytearray(encode(['Routing_Update_Delta', 0, 5, 4, [], [1, 2]]))
+        data[-7] = ord('d')
+        with self.assertRaises(ValueError):
+            decode(bytes(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
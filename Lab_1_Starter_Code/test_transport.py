@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""Tests of the fragmentation and reassembly in transport.py
+
+Run with: python -m pytest test_transport.py (or python -m unittest)
+"""
+
+import os
+import random
+import struct
+import unittest
+import zlib
+
+import transport
+from codec import PROTOCOL_VERSION
+from transport import FLAG_COMPRESSED, FRAGMENT, FRAGMENT_HEADER, MAX_DATAGRAM, Reassembler, fragment
+
+ADDR = ('127.0.0.1', 40000)
+
+
+def make_fragment(message_id, index, count, payload=b'x', flags=0):
+    return FRAGMENT_HEADER.pack(PROTOCOL_VERSION, FRAGMENT, message_id, index, count, flags) + payload
+
+
+def reassemble(datagrams, addr=ADDR):
+    '''Feeds datagrams to a new Reassembler and returns what it returned for each'''
+    reassembler = Reassembler()
+    return [reassembler.feed(datagram, addr) for datagram in datagrams]
+
+
+class TestRoundTrip(unittest.TestCase):
+    def test_small_message_is_sent_unchanged(self):
+        data = bytes([PROTOCOL_VERSION, 2]) + bytes(10)
+        self.assertEqual(fragment(data), [data])
+        self.assertEqual(reassemble([data]), [data])
+
+    def test_compressible_message(self):
+        data = bytes([PROTOCOL_VERSION, 4]) + bytes(random.Random(1).choices(b'0123', k=20000))
+        datagrams = fragment(data)
+        self.assertGreater(len(datagrams), 1)
+        self.assertLess(len(datagrams), len(data) // MAX_DATAGRAM)
+        self.assertTrue(datagrams[0][FRAGMENT_HEADER.size - 1] & FLAG_COMPRESSED)
+        self.assertTrue(all(len(datagram) <= MAX_DATAGRAM for datagram in datagrams))
+        self.assertEqual(reassemble(datagrams)[-1], data)
+
+    def test_incompressible_message(self):
+        data = bytes([PROTOCOL_VERSION, 4]) + os.urandom(5000)
+        datagrams = fragment(data)
+        self.assertEqual(len(datagrams), 5)
+        self.assertFalse(datagrams[0][FRAGMENT_HEADER.size - 1] & FLAG_COMPRESSED)
+        results = reassemble(datagrams)
+        self.assertEqual(results[:-1], [None] * 4)
+        self.assertEqual(results[-1], data)
+
+    def test_reordered_and_duplicated_fragments(self):
+        data = bytes([PROTOCOL_VERSION, 4]) + os.urandom(8000)
+        datagrams = fragment(data)
+        shuffled = datagrams + datagrams[:3]
+        random.Random(1).shuffle(shuffled)
+        reassembler = Reassembler()
+        results = [reassembler.feed(datagram, ADDR) for datagram in shuffled]
+        self.assertEqual([result for result in results if result is not None], [data])
+
+    def test_interleaved_messages_from_several_senders(self):
+        first = bytes([PROTOCOL_VERSION, 4]) + os.urandom(3000)
+        second = bytes([PROTOCOL_VERSION, 4]) + os.urandom(3000)
+        reassembler = Reassembler()
+        results = []
+        for a, b in zip(fragment(first), fragment(second)):
+            results.append(reassembler.feed(a, ADDR))
+            results.append(reassembler.feed(b, ('127.0.0.1', 40001)))
+        self.assertEqual([result for result in results if result is not None], [first, second])
+        self.assertEqual(reassembler.pending, {})
+
+
+class TestMalformedFragments(unittest.TestCase):
+    def test_truncated_header(self):
+        with self.assertRaises(ValueError):
+            reassemble([make_fragment(1, 0, 2)[:5]])
+
+    def test_wrong_version(self):
+        datagram = struct.pack('<BBIHHB', PROTOCOL_VERSION + 1, FRAGMENT, 1, 0, 2, 0)
+        with self.assertRaises(ValueError):
+            reassemble([datagram])
+
+    def test_index_out_of_range(self):
+        with self.assertRaises(ValueError):
+            reassemble([make_fragment(1, 2, 2)])
+        with self.assertRaises(ValueError):
+            reassemble([make_fragment(1, 0, 0)])
+
+    def test_count_mismatch(self):
+        reassembler = Reassembler()
+        self.assertIsNone(reassembler.feed(make_fragment(7, 0, 3), ADDR))
+        with self.assertRaises(ValueError):
+            reassembler.feed(make_fragment(7, 4, 5), ADDR)
+        with self.assertRaises(ValueError):
+            reassembler.feed(make_fragment(7, 3, 5), ADDR)
+        # The message that was started still completes
+        self.assertIsNone(reassembler.feed(make_fragment(7, 1, 3), ADDR))
+        self.assertEqual(reassembler.feed(make_fragment(7, 2, 3), ADDR), b'xxx')
+
+    def test_flags_mismatch(self):
+        reassembler = Reassembler()
+        reassembler.feed(make_fragment(7, 0, 2), ADDR)
+        with self.assertRaises(ValueError):
+            reassembler.feed(make_fragment(7, 1, 2, flags=FLAG_COMPRESSED), ADDR)
+
+    def test_bad_compressed_data(self):
+        with self.assertRaises(ValueError):
+            reassemble([make_fragment(1, 0, 1, b'not zlib', FLAG_COMPRESSED)])
+
+    def test_truncated_compressed_data(self):
+        payload = zlib.compress(os.urandom(2000))[:-10]
+        with self.assertRaises(ValueError):
+            reassemble([make_fragment(1, 0, 1, payload, FLAG_COMPRESSED)])
+
+    def test_decompression_is_bounded(self):
+        payload = zlib.compress(bytes(transport.MAX_MESSAGE_SIZE + 1), 9)
+        self.assertLess(len(payload), 70 * 1024)
+        chunks = [payload[i:i + 1000] for i in range(0, len(payload), 1000)]
+        datagrams = [make_fragment(1, i, len(chunks), chunk, FLAG_COMPRESSED) for i, chunk in enumerate(chunks)]
+        with self.assertRaises(ValueError):
+            reassemble(datagrams)
+
+    def test_incomplete_messages_expire(self):
+        reassembler = Reassembler(timeout=0)
+        reassembler.feed(make_fragment(1, 0, 2), ADDR)
+        reassembler.expire(float('inf'))
+        self.assertEqual(reassembler.pending, {})
+        self.assertEqual(reassembler.expired, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""Readers and writers of topology files for ECE50863 Lab Project 1
+
+Two formats are read, told apart by their first bytes:
+
+Text (graph_n.txt)  the number of switches on the first line, then one
+                    "<switch id> <neighbor id> <cost>" line per link
+Binary              MAGIC, format version (uint32), number of switches
+                    (uint32), number of links (uint32), then switch id,
+                    neighbor id and cost (int32, little-endian) per link
+
+Both are read in one pass into an int32 array of [switch id, neighbor id,
+cost, ...]. Text files are parsed a chunk at a time, so the lines of a large
+file are never all in memory at once, with numpy when it is installed (about
+7 times faster than int() on every number). Binary files are mapped with mmap
+and their links copied into the array in one step, without parsing.
+convert_config.py converts between the two.
+"""
+
+import mmap
+import struct
+import sys
+import warnings
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b'TOPO'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sIII')
+CHUNK_SIZE = 1 << 20 # bytes of a text file parsed at a time
+
+BIG_ENDIAN = sys.byteorder == 'big'
+
+
+def read_num_switches(config_file):
+    '''Returns the number of switches without reading the links'''
+    with open(config_file, 'rb') as f:
+        header = f.read(HEADER.size)
+        if header.startswith(MAGIC):
+            return unpack_header(header)[0]
+        f.seek(0)
+        return int(f.readline())
+
+
+def read_links(config_file):
+    '''Returns (num_switches, links) where links is an int32 array holding
+    switch id, neighbor id and cost for every link'''
+    with open(config_file, 'rb') as f:
+        if f.read(len(MAGIC)) == MAGIC:
+            return read_binary_links(f)
+        f.seek(0)
+        return read_text_links(f)
+
+
+def parse_ints(data):
+    '''Returns the whitespace separated numbers in data as an int32 array'''
+    if np is None:
+        return array('i', map(int, data.split()))
+    values = array('i')
+    if data.strip():
+        with warnings.catch_warnings():
+            # numpy only warns when it stops at something that is not a number
+            warnings.simplefilter('error', DeprecationWarning)
+            try:
+                values.frombytes(np.fromstring(data, dtype=np.int32, sep=' ').tobytes())
+            except DeprecationWarning:
+                raise ValueError('The topology file holds something that is not a number')
+    return values
+
+
+def read_text_links(f):
+    num_switches = int(f.readline())
+    links = array('i')
+    rest = b''
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        chunk = rest + chunk
+        # The last number may go on in the next chunk
+        end = max(chunk.rfind(b' '), chunk.rfind(b'\n'), chunk.rfind(b'\t'), chunk.rfind(b'\r')) + 1
+        rest = chunk[end:]
+        links.extend(parse_ints(chunk[:end]))
+    links.extend(parse_ints(rest))
+    if len(links) % 3:
+        raise ValueError(f'Every link needs a switch id, a neighbor id and a cost, got {len(links)} values')
+    return num_switches, links
+
+
+def unpack_header(header):
+    '''Returns (num_switches, num_links) from the header of a binary file'''
+    if len(header) < HEADER.size:
+        raise ValueError('Truncated topology header')
+    magic, version, num_switches, num_links = HEADER.unpack_from(header, 0)
+    if version != FORMAT_VERSION:
+        raise ValueError(f'Unsupported topology format version {version}')
+    return num_switches, num_links
+
+
+def read_binary_links(f):
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        num_switches, num_links = unpack_header(m[:HEADER.size])
+        end = HEADER.size + 3 * num_links * 4
+        if len(m) < end:
+            raise ValueError('Truncated topology file')
+        links = array('i')
+        with memoryview(m) as view:
+            links.frombytes(view[HEADER.size:end])
+    if BIG_ENDIAN:
+        links.byteswap()
+    return num_switches, links
+
+
+def write_binary_links(output_file, num_switches, links):
+    '''Writes links (an int32 array as returned by read_links()) in the
+    binary format'''
+    if BIG_ENDIAN:
+        links = array('i', links)
+        links.byteswap()
+    with open(output_file, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, num_switches, len(links) // 3))
+        f.write(links.tobytes())
+
+
+def write_text_links(output_file, num_switches, links):
+    '''Writes links in the graph_n.txt format'''
+    with open(output_file, 'w') as f:
+        f.write(f'{num_switches}\n')
+        it = iter(links)
+        f.writelines(f'{self_id} {neighbor_id} {cost}\n' for self_id, neighbor_id, cost in zip(it, it, it))
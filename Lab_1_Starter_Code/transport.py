@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+
+"""Fragmentation and reassembly of large control messages for ECE50863 Lab Project 1
+
+Every socket reads at most MAX_DATAGRAM bytes, so a message that does not fit
+(a routing table or Register_Response for a large topology) is compressed
+when that helps and split into numbered fragments. Messages that fit are
+sent unchanged.
+
+A fragment starts with the codec header byte for the protocol version and the
+FRAGMENT message type, followed by the message id, the fragment index, the
+fragment count and a flags byte, then a slice of the (maybe compressed)
+message.
+
+send_batch() sends many messages at once. On Linux it hands up to MAX_BATCH
+datagrams to a single sendmmsg() system call through ctypes, elsewhere it
+falls back to one sendto() per datagram.
+
+Every message sent through send() or send_batch() is counted by type in
+sent_stats, which controller.py and switch.py expose as the "sent" gauge of
+their metrics. If the TRANSPORT_STATS_DIR environment variable is set, the
+counts are also saved to <TRANSPORT_STATS_DIR>/<pid>.json every second
+and at exit, which is how convergence_benchmark.py collects them.
+"""
+
+import atexit
+import ctypes
+import ctypes.util
+import itertools
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from codec import MESSAGE_TYPES, PROTOCOL_VERSION
+
+MAX_DATAGRAM = 1024 # largest datagram that is sent or received
+
+FRAGMENT = 0xFF # message type of a fragment
+FLAG_COMPRESSED = 0x01
+
+FRAGMENT_HEADER = struct.Struct('<BBIHHB')
+FRAGMENT_PAYLOAD = MAX_DATAGRAM - FRAGMENT_HEADER.size
+
+MAX_MESSAGE_SIZE = 64 << 20 # largest message accepted after decompression
+
+REASSEMBLY_TIMEOUT = 5 # seconds to wait for the missing fragments of a message
+MAX_PENDING_MESSAGES = 1024 # messages being reassembled at once
+MAX_BATCH = 1024 # datagrams per sendmmsg() call (UIO_MAXIOV on Linux)
+
+STATS_DIR = os.environ.get('TRANSPORT_STATS_DIR')
+STATS_INTERVAL = 1 # seconds between saves of sent_stats
+
+message_ids = itertools.count()
+sent_stats = {} # {message type: [messages, datagrams, bytes]}
+stats_lock = threading.Lock()
+stats_saver = None # thread that saves sent_stats every STATS_INTERVAL seconds
+save_lock = threading.Lock() # the saver thread and atexit both save
+
+
+def fragment(data, compress=True):
+    '''Returns the list of datagrams to send for the encoded message data.'''
+    if len(data) <= MAX_DATAGRAM:
+        return [data]
+
+    flags = 0
+    if compress:
+        compressed = zlib.compress(data, 1)
+        if len(compressed) < len(data):
+            data = compressed
+            flags |= FLAG_COMPRESSED
+
+    message_id = next(message_ids) & 0xFFFFFFFF
+    count = (len(data) + FRAGMENT_PAYLOAD - 1) // FRAGMENT_PAYLOAD
+    if count > 0xFFFF:
+        raise ValueError(f'Message of {len(data)} bytes is too large to fragment')
+
+    datagrams = []
+    for index in range(count):
+        chunk = data[index * FRAGMENT_PAYLOAD:(index + 1) * FRAGMENT_PAYLOAD]
+        header = FRAGMENT_HEADER.pack(PROTOCOL_VERSION, FRAGMENT, message_id, index, count, flags)
+        datagrams.append(header + chunk)
+    return datagrams
+
+
+def send(sock, data, addr):
+    '''Sends the encoded message data to addr, fragmenting it if needed.'''
+    datagrams = fragment(data)
+    for datagram in datagrams:
+        sock.sendto(datagram, addr)
+    record_sent(data, datagrams)
+
+
+def record_sent(data, datagrams):
+    '''Counts the encoded message data, sent as datagrams, under its type.'''
+    global stats_saver
+    code = data[1]
+    message_type = MESSAGE_TYPES[code] if code < len(MESSAGE_TYPES) else str(code)
+    with stats_lock:
+        entry = sent_stats.get(message_type)
+        if entry is None:
+            entry = sent_stats[message_type] = [0, 0, 0]
+        entry[0] += 1
+        entry[1] += len(datagrams)
+        entry[2] += sum(len(datagram) for datagram in datagrams)
+        if STATS_DIR is not None and stats_saver is None:
+            stats_saver = threading.Thread(target=save_stats_periodically, daemon=True)
+            stats_saver.start()
+
+
+def sent_snapshot():
+    '''Returns a copy of sent_stats, {message type: [messages, datagrams, bytes]}'''
+    with stats_lock:
+        return {message_type: list(entry) for message_type, entry in sent_stats.items()}
+
+
+def save_stats_periodically():
+    while True:
+        time.sleep(STATS_INTERVAL)
+        save_stats()
+
+
+def save_stats():
+    '''Writes sent_stats to <STATS_DIR>/<pid>.json, replacing the file in 
+    one step so a reader never sees half of it.'''
+    if STATS_DIR is None:
+        return
+    stats = {'pid': os.getpid(), 'argv': sys.argv, 'time': time.time(), 'sent': sent_snapshot()}
+    path = os.path.join(STATS_DIR, f'{os.getpid()}.json')
+    with save_lock:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(stats, f)
+        os.replace(path + '.tmp', path)
+
+atexit.register(save_stats)
+
+
+class IOVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(IOVec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', MsgHdr),
+                ('msg_len', ctypes.c_uint)]
+
+
+sendmmsg = None
+# MsgHdr and sockaddr_in() follow the Linux layout, the BSDs that also have 
+# sendmmsg() lay them out differently (sin_len, socklen_t msg_iovlen)
+if sys.platform.startswith('linux'):
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        sendmmsg = libc.sendmmsg
+        sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+        sendmmsg.restype = ctypes.c_int
+    except (OSError, AttributeError, TypeError):
+        sendmmsg = None # libc without sendmmsg()
+
+sockaddr_cache = {} # {(hostname, port): sockaddr_in buffer}
+
+
+def sockaddr_in(addr):
+    '''Returns a struct sockaddr_in for the (hostname, port) address.'''
+    name = sockaddr_cache.get(addr)
+    if name is None:
+        hostname, port = addr
+        packed = struct.pack('=H', socket.AF_INET) + struct.pack('!H', port) + socket.inet_aton(socket.gethostbyname(hostname)) + bytes(8)
+        name = ctypes.create_string_buffer(packed, len(packed))
+        sockaddr_cache[addr] = name
+    return name
+
+
+def send_batch(sock, messages):
+    '''Sends a list of (data, addr) pairs of encoded messages, fragmenting 
+    them if needed, and returns the number of system calls it took. A 
+    message sent to several addresses is only fragmented once.'''
+    packets = []
+    fragments = {} # {id(data): datagrams}
+    for data, addr in messages:
+        datagrams = fragments.get(id(data))
+        if datagrams is None:
+            datagrams = fragments[id(data)] = fragment(data)
+        for datagram in datagrams:
+            packets.append((datagram, addr))
+        record_sent(data, datagrams)
+    return send_datagrams(sock, packets)
+
+
+def send_datagrams(sock, packets):
+    '''Sends a list of (datagram, addr) pairs and returns the number of 
+    system calls it took.'''
+    if sendmmsg is None or sock.family != socket.AF_INET:
+        for datagram, addr in packets:
+            sock.sendto(datagram, addr)
+        return len(packets)
+
+    calls = 0
+    for start in range(0, len(packets), MAX_BATCH):
+        batch = packets[start:start + MAX_BATCH]
+        count = len(batch)
+        messages = (MMsgHdr * count)()
+        iovecs = (IOVec * count)()
+        for i, (datagram, addr) in enumerate(batch):
+            name = sockaddr_in(addr)
+            iovecs[i].iov_base = ctypes.cast(ctypes.c_char_p(datagram), ctypes.c_void_p)
+            iovecs[i].iov_len = len(datagram)
+            header = messages[i].msg_hdr
+            header.msg_name = ctypes.addressof(name)
+            header.msg_namelen = len(name)
+            header.msg_iov = ctypes.pointer(iovecs[i])
+            header.msg_iovlen = 1
+
+        # sendmmsg() may stop early, send the rest with the next call
+        sent = 0
+        while sent < count:
+            result = sendmmsg(sock.fileno(), ctypes.addressof(messages) + sent * ctypes.sizeof(MMsgHdr), count - sent, 0)
+            calls += 1
+            if result < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+            sent += result
+    return calls
+
+
+def is_fragment(datagram):
+    return len(datagram) >= 2 and datagram[1] == FRAGMENT
+
+
+class Reassembler:
+    '''Collects the fragments of each message, keyed by sender address and
+    message id, until all of them arrived. Incomplete messages are dropped
+    after REASSEMBLY_TIMEOUT seconds.'''
+    def __init__(self, timeout=REASSEMBLY_TIMEOUT, max_pending=MAX_PENDING_MESSAGES):
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.pending = {} # {(addr, message_id): [first_seen, count, flags, {index: chunk}]}
+        self.expired = 0 # messages dropped because fragments were missing
+
+
+    def feed(self, datagram, addr):
+        '''Takes a received datagram and returns the whole message once it is
+        complete, or None while fragments are still missing. Datagrams that
+        are not fragments are returned as they are. Raises ValueError for
+        malformed fragments.'''
+        if not is_fragment(datagram):
+            return datagram
+
+        try:
+            version, message_type, message_id, index, count, flags = FRAGMENT_HEADER.unpack_from(datagram, 0)
+        except struct.error:
+            raise ValueError('Truncated fragment')
+        if version != PROTOCOL_VERSION:
+            raise ValueError(f'Unsupported protocol version {version}')
+        if count == 0 or index >= count:
+            raise ValueError(f'Bad fragment {index} of {count}')
+
+        now = time.time()
+        self.expire(now)
+
+        key = (addr, message_id)
+        entry = self.pending.get(key)
+        if entry is None:
+            if len(self.pending) >= self.max_pending:
+                # Drop the oldest message to make room
+                oldest = min(self.pending, key=lambda k: self.pending[k][0])
+                del self.pending[oldest]
+                self.expired += 1
+            entry = [now, count, flags, {}]
+            self.pending[key] = entry
+        elif count != entry[1] or flags != entry[2]:
+            raise ValueError(f'Fragment {index} of {count} does not match message {message_id} of {entry[1]} fragments')
+        entry[3][index] = datagram[FRAGMENT_HEADER.size:]
+
+        if len(entry[3]) < entry[1]:
+            return None
+
+        del self.pending[key]
+        chunks = entry[3]
+        data = b''.join(chunks[i] for i in range(entry[1]))
+        if entry[2] & FLAG_COMPRESSED:
+            # Stop at MAX_MESSAGE_SIZE, a few compressed bytes can expand 
+            # to gigabytes
+            decompressor = zlib.decompressobj()
+            try:
+                data = decompressor.decompress(data, MAX_MESSAGE_SIZE)
+            except zlib.error as e:
+                raise ValueError(f'Bad compressed message: {e}')
+            if decompressor.unconsumed_tail:
+                raise ValueError(f'Compressed message larger than {MAX_MESSAGE_SIZE} bytes')
+            if not decompressor.eof:
+                raise ValueError('Truncated compressed message')
+        return data
+
+
+    def expire(self, now):
+        '''Drops the messages that have been incomplete for too long.'''
+        if not self.pending:
+            return
+        for key in [key for key, entry in self.pending.items() if entry[0] < now - self.timeout]:
+            del self.pending[key]
+            self.expired += 1